@@ -1,14 +1,24 @@
 # ------------------------ Tess -------------------------------
 # AI/callModel.py
+import asyncio
+import inspect
 import json
 import logging
 import os
 import re
-from typing import Any, Callable, Dict, Optional
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Union
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+
+from .generation_cache import DEFAULT_GENERATION_CACHE_PATH, SQLiteGenerationCache, make_generation_key
+from .promptGen import MEAL_PLAN_JSON_SCHEMA
 
 client = OpenAI()
+async_client = AsyncOpenAI()
 logging.getLogger(__name__).setLevel(logging.DEBUG)
 
 SYSTEM = (
@@ -17,6 +27,75 @@ SYSTEM = (
 
 _CHAT_COMPLETION_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-4.1-mini")
 _RESPONSES_MODEL = os.getenv("OPENAI_RESPONSES_MODEL", "gpt-4.1-nano")
+_CHAT_TEMPERATURE = 0.6
+_RESPONSES_TEMPERATURE = 0.9
+# how many tool calls from a single assistant turn run at once
+_TOOL_CONCURRENCY = max(1, int(os.getenv("OPENAI_TOOL_CONCURRENCY", "4") or 4))
+# per-request tool-loop budget (0 disables a limit); once spent the model must answer without tools
+_TOOL_MAX_TURNS = int(os.getenv("OPENAI_TOOL_MAX_TURNS", "6") or 0)
+_TOOL_MAX_PROMPT_TOKENS = int(os.getenv("OPENAI_TOOL_MAX_PROMPT_TOKENS", "40000") or 0)
+_TOOL_MAX_SECONDS = float(os.getenv("OPENAI_TOOL_MAX_SECONDS", "45") or 0)
+
+# OPENAI_STRUCTURED_OUTPUT=on constrains output to MEAL_PLAN_JSON_SCHEMA, so the repair call never runs
+_STRUCTURED_OUTPUT = os.getenv("OPENAI_STRUCTURED_OUTPUT", "off").strip().lower() in {"1", "on", "true", "yes"}
+_CHAT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "meal_plan", "schema": MEAL_PLAN_JSON_SCHEMA, "strict": True},
+}
+_RESPONSES_TEXT_FORMAT = {
+    "format": {"type": "json_schema", "name": "meal_plan", "schema": MEAL_PLAN_JSON_SCHEMA, "strict": True},
+}
+
+# how each model output got parsed (direct, extracted, partial, repaired, repair_failed, failed)
+_PARSE_STATS: Counter = Counter()
+_PARSE_STATS_LOCK = threading.Lock()
+
+
+def _count_parse(path: str) -> None:
+    with _PARSE_STATS_LOCK:
+        _PARSE_STATS[path] += 1
+
+
+def parse_stats() -> dict[str, int]:
+    """Per-process counts of the parse path taken, e.g. to compare repair rates across modes."""
+    with _PARSE_STATS_LOCK:
+        return dict(_PARSE_STATS)
+
+
+
+def _init_generation_cache() -> SQLiteGenerationCache | None:
+    # OPENAI_GENERATION_CACHE=on serves repeat prompts from stored responses
+    if os.getenv("OPENAI_GENERATION_CACHE", "off").strip().lower() not in {"1", "on", "true", "yes"}:
+        return None
+    cache = SQLiteGenerationCache(
+        path=os.getenv("OPENAI_GENERATION_CACHE_PATH") or DEFAULT_GENERATION_CACHE_PATH,
+        ttl_seconds=float(os.getenv("OPENAI_GENERATION_CACHE_TTL", str(6 * 3600)) or 0),
+        variants=int(os.getenv("OPENAI_GENERATION_CACHE_VARIANTS", "3") or 3),
+    )
+    logging.info("Generation cache enabled at %s (%d variants per prompt)", cache.path, cache.variants)
+    return cache
+
+
+_GENERATION_CACHE = _init_generation_cache()
+
+
+def _generation_key(prompt: str, use_tools: bool) -> str:
+    model, temperature = (
+        (_CHAT_COMPLETION_MODEL, _CHAT_TEMPERATURE) if use_tools else (_RESPONSES_MODEL, _RESPONSES_TEMPERATURE)
+    )
+    if _STRUCTURED_OUTPUT:
+        model += "+schema"
+    return make_generation_key(prompt, model, temperature)
+
+
+def _cacheable(result: dict) -> bool:
+    # truncated or empty plans would keep being served instead of retried
+    return bool(isinstance(result, dict) and result.get("meals")) and not result.get("_partial")
+
+
+ToolExecutor = Callable[[str, Dict[str, Any]], Dict[str, Any]]
+# async callers may pass either a plain executor or a coroutine function
+AsyncToolExecutor = Callable[[str, Dict[str, Any]], Union[Dict[str, Any], Awaitable[Dict[str, Any]]]]
 
 _LOOKUP_INGREDIENT_TOOL = {
     "type": "function",
@@ -38,155 +117,451 @@ _LOOKUP_INGREDIENT_TOOL = {
 }
 
 
-def _parse_partial_meals(text: str | None) -> dict | None:
-    """Attempt to salvage well-formed meal objects from a truncated JSON blob."""
-    if not text:
-        return None
+def _log_usage(usage, label: str) -> None:
+    """Log prompt tokens and how many were served from the provider's prompt cache."""
+    if usage is None:
+        return
+    # chat completions report prompt_tokens(_details); the Responses API uses input_tokens(_details)
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None) or getattr(usage, "input_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) or 0
+    logging.info(
+        "%s usage: %d prompt tokens, %d cached (%.0f%%)",
+        label, prompt_tokens, cached, 100.0 * cached / prompt_tokens if prompt_tokens else 0.0,
+    )
 
-    match = re.search(r'"meals"\s*:\s*\[', text)
-    if not match:
-        return None
 
-    decoder = json.JSONDecoder()
-    meals: list[dict] = []
-    idx = match.end()
-    text_len = len(text)
+class _ToolLoopBudget:
+    """Tracks tool turns, cumulative prompt tokens and wall time for one request."""
 
-    while idx < text_len:
-        # skip whitespace or commas between entries
-        while idx < text_len and text[idx] in " \t\r\n,":
-            idx += 1
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.turns = 0
+        self.prompt_tokens = 0
+        self.spent = False
 
-        if idx >= text_len or text[idx] == ']':
-            break
+    def record(self, usage) -> None:
+        self.turns += 1
+        self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+        _log_usage(usage, f"chat turn {self.turns}")
 
-        try:
-            obj, consumed = decoder.raw_decode(text[idx:])
-        except json.JSONDecodeError as exc:
-            logging.debug("Partial decode stopped at index %s: %s", idx, exc)
-            break
+    def tool_choice(self) -> str:
+        """Return "auto" while budget remains, then "none" to force a final answer."""
+        if not self.spent:
+            reason = None
+            if _TOOL_MAX_TURNS and self.turns >= _TOOL_MAX_TURNS:
+                reason = f"{self.turns} tool turns"
+            elif _TOOL_MAX_PROMPT_TOKENS and self.prompt_tokens >= _TOOL_MAX_PROMPT_TOKENS:
+                reason = f"{self.prompt_tokens} prompt tokens"
+            elif _TOOL_MAX_SECONDS and time.monotonic() - self.started >= _TOOL_MAX_SECONDS:
+                reason = f"{time.monotonic() - self.started:.1f}s"
+            if reason:
+                logging.warning("Tool-call budget spent (%s); asking for a final answer without tools", reason)
+                self.spent = True
+        return "none" if self.spent else "auto"
 
-        if isinstance(obj, dict):
-            meals.append(obj)
-        else:
-            logging.debug("Skipping non-dict meal recovered from partial JSON: %r", obj)
 
-        idx += consumed
+_MEALS_ARRAY_RE = re.compile(r'"meals"\s*:\s*\[')
+_JSON_START_RE = re.compile(r"[\{\[]")
+# raw_decode(text, idx) parses in place, so neither path below copies the remaining text per object
+_JSON_DECODER = json.JSONDecoder()
+
+
+class _MealStreamDecoder:
+    """Incrementally pull complete meal objects out of a (possibly truncated) {"meals": [...]} payload.
+
+    feed() can be called with streamed deltas or with a whole response; each call
+    returns the meals that became complete since the previous call.
+    """
+
+    def __init__(self) -> None:
+        self._buf = ""
+        self._scan_from = 0
+        self._in_array = False
+        self._done = False
+
+    @property
+    def complete(self) -> bool:
+        """True once the closing ']' of the meals array has been seen."""
+        return self._done
+
+    def feed(self, chunk: str) -> list[dict]:
+        if self._done or not chunk:
+            return []
+        self._buf += chunk
+
+        if not self._in_array:
+            # resume a little before the old end in case '"meals": [' straddles two chunks
+            match = _MEALS_ARRAY_RE.search(self._buf, max(0, self._scan_from - 16))
+            self._scan_from = len(self._buf)
+            if not match:
+                return []
+            self._buf = self._buf[match.end():]
+            self._in_array = True
+        elif "}" not in chunk and "]" not in chunk:
+            # nothing can have completed; skip re-decoding the meal in progress
+            return []
+
+        buf = self._buf
+        buf_len = len(buf)
+        idx = 0
+        meals: list[dict] = []
+        while idx < buf_len:
+            # skip whitespace or commas between entries
+            while idx < buf_len and buf[idx] in " \t\r\n,":
+                idx += 1
+
+            if idx >= buf_len:
+                break
+            if buf[idx] == ']':
+                self._done = True
+                break
+
+            try:
+                obj, end = _JSON_DECODER.raw_decode(buf, idx)
+            except json.JSONDecodeError:
+                # object still incomplete; wait for more text
+                break
+
+            if isinstance(obj, dict):
+                meals.append(obj)
+            else:
+                logging.debug("Skipping non-dict meal recovered from partial JSON: %r", obj)
+            idx = end
+
+        # drop what has been decoded so the buffer only holds the meal in progress
+        self._buf = buf[idx:]
+        return meals
 
+
+def _parse_partial_meals(text: str | None) -> dict | None:
+    """Attempt to salvage well-formed meal objects from a truncated JSON blob."""
+    if not text:
+        return None
+
+    meals = _MealStreamDecoder().feed(text)
     if meals:
         logging.debug("Recovered %d meals from partial JSON", len(meals))
         return {"meals": meals, "_partial": True}
 
     return None
 
-def _extract_json_from_text(text: str) -> str | None:
-    """Try to extract the first JSON object or array from text and balance braces/brackets.
-
-    Returns a JSON string if extraction appears successful, otherwise None.
-    """
+def _decode_first_json(text: str) -> Any | None:
+    """Decode the first complete JSON object or array embedded in text, ignoring anything after it."""
     if not text:
         return None
-
-    # find first { or [ and try to capture a balanced JSON block
-    start_match = re.search(r"[\{\[]", text)
-    if not start_match:
+    match = _JSON_START_RE.search(text)
+    if not match:
         return None
-
-    start = start_match.start()
-    stack = []
-    pairs = {"{": "}", "[": "]"}
-    end = None
-    for i in range(start, len(text)):
-        ch = text[i]
-        if ch in "[{":
-            stack.append(pairs[ch])
-        elif ch in "}]":
-            if not stack:
-                # unmatched closing - skip
-                continue
-            expected = stack.pop()
-            if ch != expected:
-                # mismatched; give up
-                return None
-            if not stack:
-                end = i + 1
-                break
-
-    if end is None:
+    try:
+        obj, _ = _JSON_DECODER.raw_decode(text, match.start())
+    except json.JSONDecodeError as e:
+        logging.debug("raw_decode from offset %d failed: %s", match.start(), e)
         return None
-
-    candidate = text[start:end]
-    return candidate
+    return obj
 
 
 def call_model(
     prompt: str,
     *,
-    tool_executor: Optional[Callable[[str, Dict[str, Any]], Dict[str, Any]]] = None,
+    tool_executor: Optional[ToolExecutor] = None,
     max_tokens: int = 1500,
 ) -> dict:
     """Call the model via chat-completions when tools are provided; fall back to Responses API otherwise."""
 
+    key = None
+    if _GENERATION_CACHE is not None:
+        key = _generation_key(prompt, tool_executor is not None)
+        cached = _GENERATION_CACHE.get(key)
+        if cached is not None:
+            logging.debug("Serving meal plan from generation cache")
+            return cached
+
     if tool_executor is not None:
-        return _call_with_chat_tools(prompt, tool_executor=tool_executor, max_tokens=max_tokens)
-    return _call_with_responses(prompt, max_tokens=max_tokens)
+        result = _call_with_chat_tools(prompt, tool_executor=tool_executor, max_tokens=max_tokens)
+    else:
+        result = _call_with_responses(prompt, max_tokens=max_tokens)
 
+    if key is not None and _cacheable(result):
+        _GENERATION_CACHE.put(key, result)
+    return result
 
-def _call_with_chat_tools(
+
+async def call_model_async(
     prompt: str,
     *,
-    tool_executor: Callable[[str, Dict[str, Any]], Dict[str, Any]],
-    max_tokens: int,
+    tool_executor: Optional[AsyncToolExecutor] = None,
+    max_tokens: int = 1500,
 ) -> dict:
-    messages: list[dict[str, Any]] = [
+    """Async call_model on AsyncOpenAI, for running under an async worker."""
+
+    key = None
+    if _GENERATION_CACHE is not None:
+        key = _generation_key(prompt, tool_executor is not None)
+        # the cache is SQLite on disk; keep its I/O off the event loop
+        cached = await asyncio.to_thread(_GENERATION_CACHE.get, key)
+        if cached is not None:
+            logging.debug("Serving meal plan from generation cache")
+            return cached
+
+    if tool_executor is not None:
+        result = await _call_with_chat_tools_async(prompt, tool_executor=tool_executor, max_tokens=max_tokens)
+    else:
+        result = await _call_with_responses_async(prompt, max_tokens=max_tokens)
+
+    if key is not None and _cacheable(result):
+        await asyncio.to_thread(_GENERATION_CACHE.put, key, result)
+    return result
+
+
+def _initial_messages(prompt: str) -> list[dict[str, Any]]:
+    return [
         {"role": "system", "content": SYSTEM},
         {"role": "user", "content": prompt},
     ]
 
+
+def _chat_tools_request(messages: list[dict[str, Any]], max_tokens: int, tool_choice: str = "auto") -> dict[str, Any]:
+    request = {
+        "model": _CHAT_COMPLETION_MODEL,
+        "messages": messages,
+        "tools": [_LOOKUP_INGREDIENT_TOOL],
+        "tool_choice": tool_choice,
+        "temperature": _CHAT_TEMPERATURE,
+        "top_p": 1.0,
+        "max_tokens": max_tokens,
+    }
+    if _STRUCTURED_OUTPUT:
+        request["response_format"] = _CHAT_RESPONSE_FORMAT
+    return request
+
+
+def _pending_tool_calls(message) -> list[tuple[str, str, str | None]]:
+    return [(call.id, call.function.name, call.function.arguments) for call in message.tool_calls or []]
+
+
+def _call_with_chat_tools(
+    prompt: str,
+    *,
+    tool_executor: ToolExecutor,
+    max_tokens: int,
+) -> dict:
+    messages = _initial_messages(prompt)
+    budget = _ToolLoopBudget()
+
     while True:
-        response = client.chat.completions.create(
+        tool_choice = budget.tool_choice()
+        response = client.chat.completions.create(**_chat_tools_request(messages, max_tokens, tool_choice))
+        budget.record(response.usage)
+
+        message = response.choices[0].message
+        calls = _pending_tool_calls(message)
+
+        if calls and tool_choice != "none":
+            messages.append(_assistant_message_payload(message))
+            messages.extend(_run_tool_calls(calls, tool_executor))
+            continue
+
+        text = message.content or ""
+        logging.debug("Chat completion output:\n%s", text)
+        return _parse_json_with_repair(text, max_tokens)
+
+
+async def _call_with_chat_tools_async(
+    prompt: str,
+    *,
+    tool_executor: AsyncToolExecutor,
+    max_tokens: int,
+) -> dict:
+    messages = _initial_messages(prompt)
+    budget = _ToolLoopBudget()
+
+    while True:
+        tool_choice = budget.tool_choice()
+        response = await async_client.chat.completions.create(**_chat_tools_request(messages, max_tokens, tool_choice))
+        budget.record(response.usage)
+
+        message = response.choices[0].message
+        calls = _pending_tool_calls(message)
+
+        if calls and tool_choice != "none":
+            messages.append(_assistant_message_payload(message))
+            messages.extend(await _run_tool_calls_async(calls, tool_executor))
+            continue
+
+        text = message.content or ""
+        logging.debug("Chat completion output:\n%s", text)
+        return await _parse_json_with_repair_async(text, max_tokens)
+
+
+def stream_model(
+    prompt: str,
+    *,
+    tool_executor: Optional[ToolExecutor] = None,
+    max_tokens: int = 1500,
+) -> Iterator[dict]:
+    """Stream a chat completion and yield each meal object as soon as it is complete.
+
+    Tool-call turns are resolved between streamed requests; only the final
+    answer's content is decoded incrementally.
+    """
+    key = None
+    if _GENERATION_CACHE is not None:
+        key = _generation_key(prompt, True)
+        cached = _GENERATION_CACHE.get(key)
+        if cached is not None:
+            logging.debug("Serving streamed meal plan from generation cache")
+            yield from cached.get("meals") or []
+            return
+
+    messages = _initial_messages(prompt)
+    budget = _ToolLoopBudget()
+
+    while True:
+        extra: dict[str, Any] = {}
+        if tool_executor is not None:
+            extra = {"tools": [_LOOKUP_INGREDIENT_TOOL], "tool_choice": budget.tool_choice()}
+        if _STRUCTURED_OUTPUT:
+            extra["response_format"] = _CHAT_RESPONSE_FORMAT
+        stream = client.chat.completions.create(
             model=_CHAT_COMPLETION_MODEL,
             messages=messages,
-            tools=[_LOOKUP_INGREDIENT_TOOL],
-            tool_choice="auto",
-            temperature=0.6,
+            temperature=_CHAT_TEMPERATURE,
             top_p=1.0,
             max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            **extra,
         )
 
-        choice = response.choices[0]
-        message = choice.message
-        tool_calls = message.tool_calls or []
-
-        if tool_calls:
-            messages.append(_assistant_message_payload(message))
-            for call in tool_calls:
-                function_name = call.function.name
-                raw_args = call.function.arguments or "{}"
-                try:
-                    args = json.loads(raw_args)
-                except json.JSONDecodeError:
-                    logging.warning("Tool %s received invalid args JSON: %s", function_name, raw_args)
-                    args = {}
-
-                try:
-                    result = tool_executor(function_name, args) or {}
-                except Exception:
-                    logging.exception("Tool %s execution failed", function_name)
-                    result = {"ok": False, "error": "tool_execution_failed"}
-
-                messages.append(
+        decoder = _MealStreamDecoder()
+        content_parts: list[str] = []
+        pending_calls: dict[int, dict[str, str]] = {}
+        streamed: list[dict] = []
+        usage = None
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            for call in delta.tool_calls or []:
+                slot = pending_calls.setdefault(call.index, {"id": "", "name": "", "arguments": ""})
+                if call.id:
+                    slot["id"] = call.id
+                if call.function and call.function.name:
+                    slot["name"] += call.function.name
+                if call.function and call.function.arguments:
+                    slot["arguments"] += call.function.arguments
+            if delta.content:
+                content_parts.append(delta.content)
+                for meal in decoder.feed(delta.content):
+                    streamed.append(meal)
+                    yield meal
+
+        budget.record(usage)
+        if pending_calls and tool_executor is not None and not budget.spent:
+            calls = [pending_calls[i] for i in sorted(pending_calls)]
+            messages.append({
+                "role": "assistant",
+                "content": "".join(content_parts),
+                "tool_calls": [
                     {
-                        "role": "tool",
-                        "tool_call_id": call.id,
-                        "content": json.dumps(result, ensure_ascii=False),
+                        "id": call["id"],
+                        "type": "function",
+                        "function": {"name": call["name"], "arguments": call["arguments"]},
                     }
-                )
+                    for call in calls
+                ],
+            })
+            messages.extend(_run_tool_calls(
+                [(call["id"], call["name"], call["arguments"]) for call in calls],
+                tool_executor,
+            ))
             continue
 
-        text = message.content or ""
-        logging.debug("Chat completion output:\n%s", text)
-        return _parse_json_with_repair(text, max_tokens)
+        logging.debug("Streamed chat completion output (%d meals):\n%s", len(streamed), "".join(content_parts))
+        if key is not None and decoder.complete and streamed:
+            _GENERATION_CACHE.put(key, {"meals": streamed})
+        return
+
+
+def _tool_args(function_name: str, raw_args: str | None) -> Dict[str, Any]:
+    raw_args = raw_args or "{}"
+    try:
+        return json.loads(raw_args)
+    except json.JSONDecodeError:
+        logging.warning("Tool %s received invalid args JSON: %s", function_name, raw_args)
+        return {}
+
+
+def _tool_message(call_id: str, result: Dict[str, Any]) -> dict[str, Any]:
+    return {
+        "role": "tool",
+        "tool_call_id": call_id,
+        "content": json.dumps(result, ensure_ascii=False),
+    }
+
+
+def _run_tool_calls(
+    calls: list[tuple[str, str, str | None]],
+    tool_executor: ToolExecutor,
+) -> list[dict[str, Any]]:
+    """Execute (call_id, function_name, raw_args) tool calls and build the tool messages.
+
+    Calls from one turn are independent lookups, so they run on a bounded pool;
+    messages come back in the order the model issued the calls.
+    """
+    def run(call: tuple[str, str, str | None]) -> dict[str, Any]:
+        call_id, function_name, raw_args = call
+        args = _tool_args(function_name, raw_args)
+        try:
+            result = tool_executor(function_name, args) or {}
+        except Exception:
+            logging.exception("Tool %s execution failed", function_name)
+            result = {"ok": False, "error": "tool_execution_failed"}
+        return _tool_message(call_id, result)
+
+    workers = min(_TOOL_CONCURRENCY, len(calls))
+    if workers <= 1:
+        return [run(call) for call in calls]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tool-call") as pool:
+        return list(pool.map(run, calls))
+
+
+async def _execute_tool_async(
+    tool_executor: AsyncToolExecutor,
+    function_name: str,
+    args: Dict[str, Any],
+) -> Dict[str, Any]:
+    try:
+        if inspect.iscoroutinefunction(tool_executor):
+            result = await tool_executor(function_name, args)
+        else:
+            # plain executors do blocking I/O (USDA lookups); keep them off the event loop
+            result = await asyncio.to_thread(tool_executor, function_name, args)
+            if inspect.isawaitable(result):
+                result = await result
+    except Exception:
+        logging.exception("Tool %s execution failed", function_name)
+        return {"ok": False, "error": "tool_execution_failed"}
+    return result or {}
+
+
+async def _run_tool_calls_async(
+    calls: list[tuple[str, str, str | None]],
+    tool_executor: AsyncToolExecutor,
+) -> list[dict[str, Any]]:
+    limit = asyncio.Semaphore(_TOOL_CONCURRENCY)
+
+    async def run(call: tuple[str, str, str | None]) -> dict[str, Any]:
+        call_id, function_name, raw_args = call
+        async with limit:
+            result = await _execute_tool_async(tool_executor, function_name, _tool_args(function_name, raw_args))
+        return _tool_message(call_id, result)
+
+    # gather() preserves argument order, so tool messages follow the assistant's tool_calls
+    return list(await asyncio.gather(*(run(call) for call in calls)))
 
 
 def _assistant_message_payload(message) -> dict:
@@ -209,66 +584,126 @@ def _assistant_message_payload(message) -> dict:
     return payload
 
 
+def _responses_request(prompt: str, max_tokens: int) -> dict[str, Any]:
+    request = {
+        "model": _RESPONSES_MODEL,
+        "input": _initial_messages(prompt),
+        "temperature": _RESPONSES_TEMPERATURE,
+        "top_p": 1.0,
+        "max_output_tokens": max_tokens,
+    }
+    if _STRUCTURED_OUTPUT:
+        request["text"] = _RESPONSES_TEXT_FORMAT
+    return request
+
+
 def _call_with_responses(prompt: str, max_tokens: int) -> dict:
-    r = client.responses.create(
-        model=_RESPONSES_MODEL,
-        input=[
-            {"role": "system", "content": SYSTEM},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.9,
-        top_p=1.0,
-        max_output_tokens=max_tokens,
-    )
+    r = client.responses.create(**_responses_request(prompt, max_tokens))
+    _log_usage(r.usage, "responses")
     text = r.output_text or ""
     logging.debug("Raw model output (responses API):\n%s", text)
     return _parse_json_with_repair(text, max_tokens)
 
 
-def _parse_json_with_repair(text: str, max_tokens: int) -> dict:
+async def _call_with_responses_async(prompt: str, max_tokens: int) -> dict:
+    r = await async_client.responses.create(**_responses_request(prompt, max_tokens))
+    _log_usage(r.usage, "responses")
+    text = r.output_text or ""
+    logging.debug("Raw model output (responses API):\n%s", text)
+    return await _parse_json_with_repair_async(text, max_tokens)
+
+
+def _parse_json_locally(text: str) -> dict | None:
+    """Parse, extract, or salvage JSON without another model call; None if all fail."""
     # First attempt: direct parse
     try:
-        return json.loads(text)
+        parsed = json.loads(text)
+        _count_parse("direct")
+        return parsed
     except json.JSONDecodeError as e:
         logging.debug("Initial json.loads failed: %s", e)
 
-    # Try extraction of a JSON block from the text
-    candidate = _extract_json_from_text(text)
-    if candidate:
-        logging.debug("Extracted JSON candidate (truncated): %s", candidate[:1000])
-        try:
-            return json.loads(candidate)
-        except json.JSONDecodeError as e:
-            logging.debug("json.loads on extracted candidate failed: %s", e)
+    # Try the first JSON block embedded in surrounding prose
+    parsed = _decode_first_json(text)
+    if parsed is not None:
+        _count_parse("extracted")
+        return parsed
 
     # Try to salvage any meals that decoded successfully before the truncation
-    partial = _parse_partial_meals(candidate or text)
-    if partial:
-        return partial
+    partial = _parse_partial_meals(text)
+    if partial is not None:
+        _count_parse("partial")
+    return partial
+
+
+def _repair_request(text: str, max_tokens: int) -> dict[str, Any]:
+    return {
+        "model": _RESPONSES_MODEL,
+        "input": f"Fix to strictly valid JSON only (no commentary):\n{text}",
+        "temperature": 0.0,
+        "top_p": 0.0,
+        "max_output_tokens": max_tokens,
+    }
+
+
+def _parse_repaired(fixed_text: str) -> dict | None:
+    logging.debug("Repair attempt output:\n%s", fixed_text)
+    try:
+        return json.loads(fixed_text)
+    except json.JSONDecodeError as e:
+        logging.error("Repair attempt still failed to produce valid JSON: %s", e)
+
+    # Last-ditch effort: salvage whatever meals are valid in the repaired text
+    return _parse_partial_meals(fixed_text)
+
+
+def _parse_json_with_repair(text: str, max_tokens: int) -> dict:
+    parsed = _parse_json_locally(text)
+    if parsed is not None:
+        return parsed
+    if _STRUCTURED_OUTPUT:
+        # schema-constrained output only fails to parse when cut off; a repair call cannot recover it
+        _count_parse("failed")
+        logging.error("Structured output was not valid JSON (likely truncated); returning empty dict")
+        return {}
 
     # Fallback: ask the model to repair to valid JSON only
     try:
-        fix = client.responses.create(
-            model=_RESPONSES_MODEL,
-            input=f"Fix to strictly valid JSON only (no commentary):\n{text}",
-            temperature=0.0,
-            top_p=0.0,
-            max_output_tokens=max_tokens,
-        )
-        fixed_text = fix.output_text or ""
-        logging.debug("Repair attempt output:\n%s", fixed_text)
-        try:
-            return json.loads(fixed_text)
-        except json.JSONDecodeError as e:
-            logging.error("Repair attempt still failed to produce valid JSON: %s", e)
-
-        # Last-ditch effort: salvage whatever meals are valid in the repaired text
-        partial_fixed = _parse_partial_meals(fixed_text)
-        if partial_fixed:
-            return partial_fixed
+        fix = client.responses.create(**_repair_request(text, max_tokens))
+        repaired = _parse_repaired(fix.output_text or "")
+        if repaired is not None:
+            _count_parse("repaired")
+            logging.info("JSON repair call used; parse stats so far: %s", parse_stats())
+            return repaired
+    except Exception as e:
+        logging.error("Error during repair request: %s", e)
+
+    _count_parse("repair_failed")
+    logging.error("Unable to parse model output as JSON; returning empty dict")
+    return {}
+
+
+async def _parse_json_with_repair_async(text: str, max_tokens: int) -> dict:
+    parsed = _parse_json_locally(text)
+    if parsed is not None:
+        return parsed
+    if _STRUCTURED_OUTPUT:
+        # schema-constrained output only fails to parse when cut off; a repair call cannot recover it
+        _count_parse("failed")
+        logging.error("Structured output was not valid JSON (likely truncated); returning empty dict")
+        return {}
+
+    try:
+        fix = await async_client.responses.create(**_repair_request(text, max_tokens))
+        repaired = _parse_repaired(fix.output_text or "")
+        if repaired is not None:
+            _count_parse("repaired")
+            logging.info("JSON repair call used; parse stats so far: %s", parse_stats())
+            return repaired
     except Exception as e:
         logging.error("Error during repair request: %s", e)
 
+    _count_parse("repair_failed")
     logging.error("Unable to parse model output as JSON; returning empty dict")
     return {}
 
@@ -0,0 +1,139 @@
+# Persistent on-disk cache for USDA ingredient lookups.
+# Facts picked by USDAIngredientRetriever are stored in a SQLite file so every
+# gunicorn worker on the host shares them and they survive restarts.
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Sequence
+
+from .retrieval_contract import IngredientFact
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), "usda_cache.sqlite3")
+
+# bump when the stored payload or pick logic changes so old rows are ignored
+_KEY_VERSION = "v1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS facts (
+    key        TEXT PRIMARY KEY,
+    payload    TEXT,
+    expires_at REAL NOT NULL,
+    last_used  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS facts_last_used ON facts (last_used);
+"""
+
+# only rewrite last_used when it is this stale, so hot reads stay read-only
+_TOUCH_INTERVAL_S = 60.0
+
+# paths whose WAL mode and schema are already set up (both persist in the file)
+_READY_PATHS: set[str] = set()
+_READY_LOCK = threading.Lock()
+
+
+def make_cache_key(term: str, data_types: Sequence[str], page_size: int) -> str:
+    normalized = " ".join((term or "").strip().lower().split())
+    types = ",".join(sorted(str(t).strip().lower() for t in (data_types or ())))
+    return f"{_KEY_VERSION}|{normalized}|{types}|{int(page_size)}"
+
+
+@dataclass(slots=True)
+class SQLiteFactCache:
+    """TTL + size-bounded fact store; misses are cached too (shorter TTL)."""
+
+    path: str = DEFAULT_CACHE_PATH
+    ttl_seconds: float = 7 * 24 * 3600.0
+    miss_ttl_seconds: float = 3600.0
+    max_entries: int = 5000
+    _local: threading.local = field(default_factory=threading.local, init=False, repr=False)
+
+    # ---------------- public API ----------------
+    def get(self, key: str) -> tuple[bool, IngredientFact | None]:
+        """Return (hit, fact). A hit with fact=None is a cached "no result"."""
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT payload, expires_at, last_used FROM facts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return False, None
+            payload, expires_at, last_used = row
+            if expires_at <= now:
+                conn.execute("DELETE FROM facts WHERE key = ?", (key,))
+                return False, None
+            if now - last_used > _TOUCH_INTERVAL_S:
+                conn.execute("UPDATE facts SET last_used = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as exc:
+            logger.warning("USDA cache read failed for %s: %s", key, exc)
+            return False, None
+
+        if payload is None:
+            return True, None
+        try:
+            return True, IngredientFact.from_dict(json.loads(payload))
+        except (KeyError, TypeError, ValueError) as exc:
+            logger.debug("Discarding unreadable USDA cache row %s: %s", key, exc)
+            return False, None
+
+    def put(self, key: str, fact: IngredientFact | None) -> None:
+        now = time.time()
+        ttl = self.ttl_seconds if fact is not None else self.miss_ttl_seconds
+        if ttl <= 0:
+            return
+        payload = json.dumps(fact.to_dict(), ensure_ascii=False) if fact is not None else None
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO facts (key, payload, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, payload, now + ttl, now),
+            )
+            self._evict(conn, now)
+        except sqlite3.Error as exc:
+            logger.warning("USDA cache write failed for %s: %s", key, exc)
+
+    def clear(self) -> None:
+        try:
+            self._connect().execute("DELETE FROM facts")
+        except sqlite3.Error as exc:
+            logger.warning("USDA cache clear failed: %s", exc)
+
+    # ---------------- helpers ----------------
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM facts WHERE expires_at <= ?", (now,))
+        if self.max_entries <= 0:
+            return
+        (count,) = conn.execute("SELECT COUNT(*) FROM facts").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM facts WHERE key IN "
+                "(SELECT key FROM facts ORDER BY last_used ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # one connection per thread and per process (gunicorn forks after import)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _READY_LOCK:
+            if self.path not in _READY_PATHS:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                _READY_PATHS.add(self.path)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
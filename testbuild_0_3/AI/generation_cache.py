@@ -0,0 +1,130 @@
+# Optional cache of whole model responses for identical generation requests.
+# Keyed on the final prompt plus model and temperature; each key holds up to N
+# distinct responses and serves a random one once full, so popular forms skip
+# the model without every user getting the exact same plan.
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GENERATION_CACHE_PATH = os.path.join(os.path.dirname(__file__), "generation_cache.sqlite3")
+
+# bump when the response shape changes so old rows are ignored
+_KEY_VERSION = "v1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key        TEXT NOT NULL,
+    digest     TEXT NOT NULL,
+    payload    TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (key, digest)
+);
+CREATE INDEX IF NOT EXISTS responses_created ON responses (created_at);
+"""
+
+
+def make_generation_key(prompt: str, model: str, temperature: float) -> str:
+    # trailing whitespace and blank-line differences do not change what the model sees in practice
+    canonical = "\n".join(line.rstrip() for line in (prompt or "").strip().splitlines())
+    raw = f"{_KEY_VERSION}\x00{model}\x00{float(temperature):.3f}\x00{canonical}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+@dataclass(slots=True)
+class SQLiteGenerationCache:
+    """Up to `variants` distinct responses per key, each kept for ttl_seconds."""
+
+    path: str = DEFAULT_GENERATION_CACHE_PATH
+    ttl_seconds: float = 6 * 3600.0
+    variants: int = 3
+    max_keys: int = 2000
+    _local: threading.local = field(default_factory=threading.local, init=False, repr=False)
+
+    # ---------------- public API ----------------
+    def get(self, key: str) -> dict | None:
+        """A random stored response once the key holds `variants` of them, else None."""
+        now = time.time()
+        try:
+            rows = self._connect().execute(
+                "SELECT payload FROM responses WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl_seconds),
+            ).fetchall()
+        except sqlite3.Error as exc:
+            logger.warning("Generation cache read failed: %s", exc)
+            return None
+
+        # keep calling the model until there are enough variants to rotate through
+        if not rows or len(rows) < self.variants:
+            return None
+        try:
+            return json.loads(random.choice(rows)[0])
+        except ValueError as exc:
+            logger.debug("Discarding unreadable generation cache row: %s", exc)
+            return None
+
+    def put(self, key: str, response: dict) -> None:
+        if self.ttl_seconds <= 0 or self.variants <= 0:
+            return
+        payload = json.dumps(response, ensure_ascii=False, sort_keys=True)
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR IGNORE INTO responses (key, digest, payload, created_at) VALUES (?, ?, ?, ?)",
+                (key, digest, payload, now),
+            )
+            # newest `variants` responses per key win
+            conn.execute(
+                "DELETE FROM responses WHERE key = ? AND digest NOT IN "
+                "(SELECT digest FROM responses WHERE key = ? ORDER BY created_at DESC LIMIT ?)",
+                (key, key, self.variants),
+            )
+            self._evict(conn, now)
+        except sqlite3.Error as exc:
+            logger.warning("Generation cache write failed: %s", exc)
+
+    def clear(self) -> None:
+        try:
+            self._connect().execute("DELETE FROM responses")
+        except sqlite3.Error as exc:
+            logger.warning("Generation cache clear failed: %s", exc)
+
+    # ---------------- helpers ----------------
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl_seconds,))
+        if self.max_keys <= 0:
+            return
+        (count,) = conn.execute("SELECT COUNT(DISTINCT key) FROM responses").fetchone()
+        overflow = count - self.max_keys
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses GROUP BY key ORDER BY MAX(created_at) ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # one connection per thread and per process (gunicorn forks after import)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
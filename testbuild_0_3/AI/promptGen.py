@@ -1,20 +1,22 @@
 # ------------------------ Tess -------------------------------
+import os
+from functools import lru_cache
 from textwrap import dedent
 from typing import Any
 
 # local imports when running inside the package
 try:
     from . import constraints_store
-    from .retrieval_contract import RetrievalBatch
+    from .retrieval_contract import RetrievalBatch, approx_tokens
 except ImportError:  # script execution fallback
     import importlib
-    import os
     import sys
     PACKAGE_ROOT = os.path.dirname(os.path.dirname(__file__))
     if PACKAGE_ROOT not in sys.path:
         sys.path.insert(0, PACKAGE_ROOT)
     constraints_store = importlib.import_module("AI.constraints_store")
     RetrievalBatch = importlib.import_module("AI.retrieval_contract").RetrievalBatch
+    approx_tokens = importlib.import_module("AI.retrieval_contract").approx_tokens
 
 # Schema the model must produce (backend-friendly)
 # - ingredients are objects with explicit weights
@@ -28,6 +30,49 @@ SCHEMA = (
         '}]}'
 )
 
+# SCHEMA as a strict JSON Schema for structured-output mode (OPENAI_STRUCTURED_OUTPUT=on).
+# Strict mode requires every property to be listed in "required", so the optional note is nullable.
+MEAL_PLAN_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "meals": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "mealType": {"type": "string", "enum": ["breakfast", "lunch", "dinner"]},
+                    "name": {"type": "string"},
+                    "ingredients": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "name": {"type": "string"},
+                                "weight_g": {"type": "number"},
+                                "note": {"type": ["string", "null"]},
+                            },
+                            "required": ["name", "weight_g", "note"],
+                            "additionalProperties": False,
+                        },
+                    },
+                    "instructions": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["mealType", "name", "ingredients", "instructions"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["meals"],
+    "additionalProperties": False,
+}
+
+# facts block rendering: compact per-100 g table capped at a token budget (0 = no cap)
+_FACTS_COMPACT = os.getenv("PROMPT_FACTS_COMPACT", "on").strip().lower() != "off"
+_FACTS_TOKEN_BUDGET = int(os.getenv("PROMPT_FACTS_TOKEN_BUDGET", "250") or 0)
+
+# facts shown above the body were already looked up; each skipped lookup saves a tool-call turn
+_KNOWN_FACTS_NOTE = "These facts are already verified; call lookupIngredient only for ingredients not listed here."
+
 def safe_int(value, default=0, non_negative=True):
     try:
         iv = int(value)
@@ -35,7 +80,8 @@ def safe_int(value, default=0, non_negative=True):
     except (ValueError, TypeError):
         return default
 
-def _constraint_text(dietary_restrictions: str, calories: int, banned_items: list[str]):
+@lru_cache(maxsize=256)
+def _constraint_text(dietary_restrictions: str, calories: int, banned_items: tuple[str, ...]):
     extras = []
     if isinstance(dietary_restrictions, str) and dietary_restrictions.strip() and dietary_restrictions.lower() != "none":
         extras.append(f"Dietary constraints: {dietary_restrictions}")
@@ -52,15 +98,69 @@ def _constraint_text(dietary_restrictions: str, calories: int, banned_items: lis
     )
     return constraint_text, banned_rule
 
-def generate_prompt(
+# Everything that is identical across requests goes first so the provider's prompt
+# cache can reuse it (SYSTEM + this prefix); per-request details follow in the suffix.
+STATIC_PROMPT_PREFIX = dedent(f"""
+    You generate creative meal recipes.
+    Do NOT estimate nutrition totals yourself—our backend computes calories and macros from the ingredient weights.
+
+    Return ONLY valid JSON using this schema:
+    {SCHEMA}
+
+    Hard requirements:
+    1) Ingredient entries MUST be objects with explicit grams:
+        - "name": plain ingredient name (e.g., "chicken breast, cooked, skinless")
+        - "weight_g": number (grams, REQUIRED)
+        - "note": string (OPTIONAL; brief prep or sourcing note)
+        (no nutrition totals or other keys; backend derives everything else)
+    2) Before finalizing ingredients, call the tool:
+        lookupIngredient({{"ingredient":"<plain term>"}})
+        Use tool results ONLY to confirm the ingredient is sensible and commonly available.
+        If a lookup fails, replace the ingredient with a similar one and proceed. Do NOT output tool payloads.
+    3) Instructions must be a list of concise, numbered steps (strings). Keep them cook-friendly.
+    4) JSON only: no prose outside the JSON, no comments, no trailing commas.
+
+    Quality rules:
+    - Be creative: vary cuisines, proteins, grains, and dominant flavors across meals.
+    - Use 4–10 ingredients per meal. Prefer fresh whole foods; pantry staples ok (beans, tomatoes, broth).
+""").strip()
+
+
+# Rendered fragments are memoized per distinct input, so repeat requests with the same
+# diet, banned list, calorie rules or variety preset reuse the strings instead of rebuilding them.
+@lru_cache(maxsize=256)
+def _rules_section(dietary_restrictions: str, calories: int, banned_items: tuple[str, ...]) -> str:
+    constraint_text, banned_rule = _constraint_text(dietary_restrictions, calories, banned_items)
+    # the constraint bullets continue the prefix's "Quality rules" list
+    return (
+        f"{STATIC_PROMPT_PREFIX}\n- Always avoid banned ingredients if any are provided. {constraint_text}"
+        f"\n- {banned_rule}"
+    )
+
+
+@lru_cache(maxsize=256)
+def _calorie_section(calorie_rules: tuple[str, ...]) -> str:
+    return "Calorie goals (backend-enforced):\n" + "\n".join(f"- {rule}" for rule in calorie_rules)
+
+
+@lru_cache(maxsize=256)
+def _variety_section(variety_context: str) -> str:
+    return (
+        "Variety focus:\n"
+        f"- {variety_context}\n"
+        "- Include at least one composed cooked dish (stew, pasta, grain bowl) and keep cold salads/smoothies to at most one meal.\n"
+        "- Rotate the dominant protein or plant-based centerpiece across meals."
+    )
+
+
+def generate_prompt_sections(
     merged_constraints: dict | None = None,
     retrieval_batch: RetrievalBatch | None = None,
     calorie_rules: list[str] | None = None,
     variety_context: str | None = None,
-) -> str:
-    """
-    Creative recipes; nutrition totals are computed in backend from ingredient weights.
-    """
+    avoid_recipes: list[str] | None = None,
+) -> list[tuple[str, str]]:
+    """(section name, text) pairs in prompt order; join with join_prompt_sections()."""
     prefs = merged_constraints or {}
 
     dietary_restrictions = prefs.get("dietary_restrictions") or prefs.get("diet") or "none"
@@ -68,61 +168,69 @@ def generate_prompt(
     num_lunch     = safe_int(prefs.get("num_lunch",    prefs.get("num2", 0)))
     num_dinner    = safe_int(prefs.get("num_dinner",   prefs.get("num3", 1)))
     calories      = safe_int(prefs.get("calories", 0))
-    banned_items  = [str(x).strip() for x in (prefs.get("banned_ingredients") or []) if str(x).strip()]
+    banned_items  = tuple(str(x).strip() for x in (prefs.get("banned_ingredients") or []) if str(x).strip())
 
-    constraint_text, banned_rule = _constraint_text(dietary_restrictions, calories, banned_items)
+    sections = [("rules", _rules_section(str(dietary_restrictions), calories, banned_items))]
 
-    facts_block = ""
     if retrieval_batch:
-        block = retrieval_batch.to_prompt_block()
+        block = retrieval_batch.to_prompt_block(
+            token_budget=_FACTS_TOKEN_BUDGET or None,
+            compact=_FACTS_COMPACT,
+        )
         if block:
-            facts_block = block + "\n\n"
+            sections.append(("facts", block + "\n" + _KNOWN_FACTS_NOTE))
 
-    calorie_lines = ""
     if calorie_rules:
-        bullet_lines = "\n        ".join(f"- {rule}" for rule in calorie_rules)
-        calorie_lines = f"Calorie goals (backend-enforced):\n        {bullet_lines}\n\n"
+        sections.append(("calorie_goals", _calorie_section(tuple(calorie_rules))))
 
-    variety_lines = ""
     if variety_context:
-        variety_lines = dedent(f"""
-        Variety focus:
-        - {variety_context}
-        - Include at least one composed cooked dish (stew, pasta, grain bowl) and keep cold salads/smoothies to at most one meal.
-        - Rotate the dominant protein or plant-based centerpiece across meals.
-
-        """)
-
-    body = dedent(f"""
-        You generate creative meal recipes.
-        Do NOT estimate nutrition totals yourself—our backend computes calories and macros from the ingredient weights.
-
-        Return ONLY valid JSON using this schema:
-        {SCHEMA}
-
-        Make exactly {num_breakfast} breakfast, {num_lunch} lunch, and {num_dinner} dinner recipes.
-
-          Hard requirements:
-          1) Ingredient entries MUST be objects with explicit grams:
-              - "name": plain ingredient name (e.g., "chicken breast, cooked, skinless")
-              - "weight_g": number (grams, REQUIRED)
-              - "note": string (OPTIONAL; brief prep or sourcing note)
-              (no nutrition totals or other keys; backend derives everything else)
-          2) Before finalizing ingredients, call the tool:
-           lookupIngredient({{"ingredient":"<plain term>"}})
-           Use tool results ONLY to confirm the ingredient is sensible and commonly available.
-           If a lookup fails, replace the ingredient with a similar one and proceed. Do NOT output tool payloads.
-          3) Instructions must be a list of concise, numbered steps (strings). Keep them cook-friendly.
-                    4) JSON only: no prose outside the JSON, no comments, no trailing commas.
-
-                {calorie_lines}{variety_lines}Quality rules:
-        - Be creative: vary cuisines, proteins, grains, and dominant flavors across meals.
-        - Use 4–10 ingredients per meal. Prefer fresh whole foods; pantry staples ok (beans, tomatoes, broth).
-        - Always avoid banned ingredients if any are provided. {constraint_text}
-        - {banned_rule}
-    """).strip()
-
-    return f"{facts_block}{body}" if facts_block else body
+        sections.append(("variety", _variety_section(variety_context)))
+
+    request_line = f"Make exactly {num_breakfast} breakfast, {num_lunch} lunch, and {num_dinner} dinner recipes."
+    if avoid_recipes:
+        request_line += "\nThese recipes are already in the plan; do NOT repeat them or close variants: " + "; ".join(avoid_recipes)
+    sections.append(("request", request_line))
+    return sections
+
+
+def join_prompt_sections(sections: list[tuple[str, str]]) -> str:
+    return "\n\n".join(text for _, text in sections)
+
+
+def section_token_counts(sections: list[tuple[str, str]]) -> dict[str, int]:
+    """Approximate tokens per section, to see what inflates a prompt.
+
+    The shared STATIC_PROMPT_PREFIX at the head of "rules" is reported on its own
+    as "static_prefix", so "rules" only counts this request's constraint bullets.
+    """
+    counts: dict[str, int] = {}
+    for name, text in sections:
+        if name == "rules" and text.startswith(STATIC_PROMPT_PREFIX):
+            counts["static_prefix"] = approx_tokens(STATIC_PROMPT_PREFIX)
+            text = text[len(STATIC_PROMPT_PREFIX):].lstrip("\n")
+        counts[name] = approx_tokens(text)
+    return counts
+
+
+def generate_prompt(
+    merged_constraints: dict | None = None,
+    retrieval_batch: RetrievalBatch | None = None,
+    calorie_rules: list[str] | None = None,
+    variety_context: str | None = None,
+    avoid_recipes: list[str] | None = None,
+) -> str:
+    """
+    Creative recipes; nutrition totals are computed in backend from ingredient weights.
+    avoid_recipes lists dishes already in the plan (used when retrying missing slots).
+    Returns STATIC_PROMPT_PREFIX followed by this request's details.
+    """
+    return join_prompt_sections(generate_prompt_sections(
+        merged_constraints,
+        retrieval_batch=retrieval_batch,
+        calorie_rules=calorie_rules,
+        variety_context=variety_context,
+        avoid_recipes=avoid_recipes,
+    ))
 
 # -------------------- User + Constraints Wrapper -------------------------
 def user_to_prompt(user: Any) -> str:
@@ -181,7 +289,8 @@ def build_prompt(
         variety_context=variety_context,
     )
 
-    header = ""
-    if ufrag: header += ufrag + "\n"
-    if constraint_lines: header += "Constraints: " + "; ".join(constraint_lines) + "\n"
-    return header + body
+    # per-user details trail the shared prefix so it stays cacheable
+    footer = ""
+    if ufrag: footer += "\n" + ufrag
+    if constraint_lines: footer += "\nConstraints: " + "; ".join(constraint_lines)
+    return body + ("\n" + footer if footer else "")
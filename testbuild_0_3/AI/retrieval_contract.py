@@ -5,9 +5,16 @@
 
 from __future__ import annotations
 
+import math
 from dataclasses import asdict, dataclass, field
 from typing import Dict, Iterable, List, Optional
 
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English prose and JSON)."""
+    return math.ceil(len(text or "") / 4)
+
+
 # Define dataclasses for nutrition facts
 @dataclass(slots=True)
 class NutritionBreakdown:
@@ -29,6 +36,11 @@ class NutritionBreakdown:
             + (f"; micros: {micros_text}" if micros_text else "")
         )
 
+    def per_100g(self) -> tuple[float, float, float, float]:
+        """(kcal, protein, carbs, fats) scaled to 100 g."""
+        scale = 100.0 / self.serving_size_g if self.serving_size_g else 1.0
+        return (self.calories * scale, self.protein_g * scale, self.carbs_g * scale, self.fats_g * scale)
+
 # Atomic record describing single retreived row (of ingredient facts), pulled 
 @dataclass(slots=True)
 class IngredientFact:
@@ -49,6 +61,31 @@ class IngredientFact:
             f"[{self.nutrition.to_prompt_fragment()}]"
         )
 
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "canonical_name": self.canonical_name,
+            "source_id": self.source_id,
+            "summary": self.summary,
+            "nutrition": asdict(self.nutrition),
+            "confidence": self.confidence,
+            "tags": list(self.tags),
+            "source_serving_size_g": self.source_serving_size_g,
+        }
+
+    # rebuild a fact from to_dict() output (used by the on-disk lookup cache)
+    @classmethod
+    def from_dict(cls, data: Dict[str, object]) -> "IngredientFact":
+        nutrition = NutritionBreakdown(**dict(data["nutrition"]))
+        return cls(
+            canonical_name=str(data["canonical_name"]),
+            source_id=str(data["source_id"]),
+            summary=str(data.get("summary") or ""),
+            nutrition=nutrition,
+            confidence=float(data.get("confidence", 1.0)),
+            tags=list(data.get("tags") or []),
+            source_serving_size_g=data.get("source_serving_size_g"),
+        )
+
 # groups IngredientFact instances for a recipe request
 # helpers to append items and format properly for the prompt
 @dataclass(slots=True)
@@ -61,11 +98,46 @@ class RetrievalBatch:
     def extend(self, new_facts: Iterable[IngredientFact]) -> None:
         self.facts.extend(new_facts)
 
-    def to_prompt_block(self, heading: str = "Supporting ingredient facts") -> str:
-        if not self.facts:
+    def to_prompt_block(
+        self,
+        heading: str = "Supporting ingredient facts",
+        *,
+        token_budget: int | None = None,
+        compact: bool = False,
+    ) -> str:
+        """Render facts for the prompt.
+
+        compact=True uses one table row per fact (kcal and P/C/F per 100 g) instead of
+        the summary text. With token_budget, facts are kept in batch order (callers
+        list the terms that matter most first) until the next row would exceed the budget.
+        """
+        facts = [fact for fact in self.facts if fact]
+        if not facts:
             return ""
-        fragments = "\n".join(fact.to_prompt_fragment() for fact in self.facts)
-        return f"{heading}:\n{fragments}"
+
+        if compact:
+            header = f"{heading} (per 100 g):\nname | kcal | protein g | carbs g | fat g"
+            rows = []
+            for fact in facts:
+                kcal, protein, carbs, fats = fact.nutrition.per_100g()
+                rows.append(f"{fact.canonical_name} | {kcal:.0f} | {protein:.1f} | {carbs:.1f} | {fats:.1f}")
+        else:
+            header = f"{heading}:"
+            rows = [fact.to_prompt_fragment() for fact in facts]
+
+        if token_budget is not None:
+            used = approx_tokens(header)
+            kept = []
+            for row in rows:
+                cost = approx_tokens(row) + 1
+                if used + cost > token_budget:
+                    break
+                kept.append(row)
+                used += cost
+            rows = kept
+            if not rows:
+                return ""
+        return header + "\n" + "\n".join(rows)
 
     def to_dict(self) -> Dict[str, object]:
         return {
@@ -6,11 +6,13 @@ from __future__ import annotations
 import logging
 import os
 import re
-from dataclasses import dataclass
-from typing import List, Protocol, Sequence, Set
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Protocol, Sequence, Set
 
+from .fact_cache import SQLiteFactCache, make_cache_key
 from .retrieval_contract import IngredientFact, NutritionBreakdown, RetrievalBatch
-from .usda_client import USDAFoodDataClient
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +57,12 @@ _NUTRIENT_ID_MAP = {
 class IngredientRetriever(Protocol):
     def fetch(self, ingredient_names: Sequence[str]) -> RetrievalBatch: ...
 
+# USDAFoodDataClient (live API) and LocalFoodDataClient (bulk import) both fit
+class FoodSearchClient(Protocol):
+    def search_foods(
+        self, query: str, *, page_size: int = 5, data_types: Sequence[str] | None = None
+    ) -> List[Dict]: ...
+
 # -------------- Stub (unchanged) ----------
 @dataclass(slots=True)
 class StubIngredientRetriever:
@@ -79,39 +87,86 @@ DEFAULT_STUB_STORE = {
 # -------------- USDA retriever ------------
 @dataclass(slots=True)
 class USDAIngredientRetriever:
-    client: USDAFoodDataClient
+    client: FoodSearchClient
     page_size: int = int(os.getenv("USDA_PAGE_SIZE", "8") or 8)
     data_types: Sequence[str] = _RECOMMENDED_TYPES
     min_match_ratio: float = float(os.getenv("USDA_MIN_MATCH", "0.40") or 0.40)
+    cache: SQLiteFactCache | None = None
+    max_concurrency: int = int(os.getenv("USDA_FETCH_CONCURRENCY", "4") or 4)
+    _pool: ThreadPoolExecutor | None = field(default=None, init=False, repr=False)
+    _pool_pid: int | None = field(default=None, init=False, repr=False)
+    _pool_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
 
     def fetch(self, terms: Sequence[str]) -> RetrievalBatch:
-        facts: List[IngredientFact | None] = []
         qterms = [t for t in terms if (t or "").strip()]
-        for term in qterms:
-            items = self.client.search_foods(term, page_size=self.page_size, data_types=self.data_types)
-            if not items:
-                logger.debug("USDA: no results for %s", term)
-                facts.append(None)
-                continue
+        if min(self.max_concurrency, len(qterms)) <= 1:
+            facts: List[IngredientFact | None] = [self._fetch_one(term) for term in qterms]
+        else:
+            # map() keeps input order, so facts[i] still lines up with qterms[i]
+            facts = list(self._executor().map(self._fetch_one, qterms))
+        return RetrievalBatch(query_terms=list(qterms), facts=facts)
 
-            tokens = self._tokenize(term)
-            picked = self._select_food(term, tokens, items) if USE_RERANK else items[0]
-            fact = self._food_to_fact(term, picked)
-            if fact is None:
-                # fall back to first usable item if our pick fails sanity
-                for alt in items:
-                    fact = self._food_to_fact(term, alt)
-                    if fact:
-                        picked = alt
-                        break
-            facts.append(fact)
-
-            # Debug: show what we used
-            if picked:
-                logger.debug("USDA pick for '%s' → %s (fdcId=%s)",
-                             term, picked.get("description","?"), picked.get("fdcId"))
+    def cached(self, terms: Sequence[str]) -> RetrievalBatch:
+        """Facts already in the cache for terms, without calling the client; misses are None."""
+        qterms = [t for t in terms if (t or "").strip()]
+        facts: List[IngredientFact | None] = []
+        for term in qterms:
+            hit, fact = False, None
+            if self.cache is not None:
+                hit, fact = self.cache.get(make_cache_key(term, self.data_types, self.page_size))
+            facts.append(fact if hit else None)
         return RetrievalBatch(query_terms=list(qterms), facts=facts)
 
+    def warm(self, terms: Sequence[str]) -> int:
+        """Look terms up one at a time on the calling thread so they land in the cache.
+
+        Runs outside the fetch pool so background warming never queues ahead of
+        lookups a request is waiting on. Returns how many terms found a fact.
+        """
+        return sum(1 for term in terms if (term or "").strip() and self._fetch_one(term))
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # long-lived threads keep their thread-local SQLite cache connections;
+        # gunicorn forks after import, so each worker process builds its own pool
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="usda-fetch")
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _fetch_one(self, term: str) -> IngredientFact | None:
+        cache_key = make_cache_key(term, self.data_types, self.page_size)
+        if self.cache is not None:
+            hit, cached = self.cache.get(cache_key)
+            if hit:
+                logger.debug("USDA cache hit for '%s'", term)
+                return cached
+
+        items = self.client.search_foods(term, page_size=self.page_size, data_types=self.data_types)
+        if not items:
+            logger.debug("USDA: no results for %s", term)
+            # not cached: search_foods also returns [] when the request itself failed
+            return None
+
+        tokens = self._tokenize(term)
+        picked = self._select_food(term, tokens, items) if USE_RERANK else items[0]
+        fact = self._food_to_fact(term, picked)
+        if fact is None:
+            # fall back to first usable item if our pick fails sanity
+            for alt in items:
+                fact = self._food_to_fact(term, alt)
+                if fact:
+                    picked = alt
+                    break
+        if self.cache is not None:
+            self.cache.put(cache_key, fact)
+
+        # Debug: show what we used
+        if picked:
+            logger.debug("USDA pick for '%s' → %s (fdcId=%s)",
+                         term, picked.get("description","?"), picked.get("fdcId"))
+        return fact
+
     # ---------------- helpers ----------------
     @staticmethod
     def _tokenize(text: str) -> Set[str]:
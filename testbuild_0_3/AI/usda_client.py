@@ -1,13 +1,33 @@
 from __future__ import annotations
 
 import logging
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, field
 from typing import Dict, List, Sequence
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# longest we sleep between retries, whatever Retry-After asks for; a longer
+# wait would hold a request thread (and, with pool_block, everyone queued
+# behind it for a connection), so past this we give up and let the caller fall back
+_MAX_RETRY_WAIT_S = 2.0
+
+
+class _CappedRetry(Retry):
+    """Retry that honors Retry-After only up to _MAX_RETRY_WAIT_S."""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, _MAX_RETRY_WAIT_S)
+
 
 @dataclass(slots=True)
 class USDAFoodDataClient:
@@ -16,6 +36,10 @@ class USDAFoodDataClient:
     api_key: str
     base_url: str = "https://api.nal.usda.gov/fdc/v1"
     timeout: float = 5.0
+    # keep-alive pool shared by every thread using this client
+    pool_size: int = 8
+    max_retries: int = 2
+    backoff_factor: float = 0.3
 
     _DEFAULT_DATA_TYPES: Sequence[str] = (
         "Foundation",
@@ -23,13 +47,49 @@ class USDAFoodDataClient:
         "Survey (FNDDS)"
     )
 
+    _session: requests.Session | None = field(default=None, init=False, repr=False)
+    _session_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def _get_session(self) -> requests.Session:
+        if self._session is not None:
+            return self._session
+        with self._session_lock:
+            if self._session is None:
+                retry = _CappedRetry(
+                    total=self.max_retries,
+                    backoff_factor=self.backoff_factor,
+                    backoff_max=_MAX_RETRY_WAIT_S,
+                    status_forcelist=_RETRY_STATUSES,
+                    allowed_methods=frozenset({"POST"}),
+                    respect_retry_after_header=True,
+                    raise_on_status=False,  # hand the last response to raise_for_status()
+                )
+                # pool_block caps open connections to the USDA host at pool_size
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.pool_size,
+                    max_retries=retry,
+                    pool_block=True,
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+        return self._session
+
+    def close(self) -> None:
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
     def _post(self, endpoint: str, payload: Dict) -> Dict:
         if not self.api_key:
             raise ValueError("USDA API key is required for USDAFoodDataClient")
 
         url = f"{self.base_url.rstrip('/')}/{endpoint.lstrip('/')}"
         params = {"api_key": self.api_key}
-        resp = requests.post(url, params=params, json=payload, timeout=self.timeout)
+        resp = self._get_session().post(url, params=params, json=payload, timeout=self.timeout)
         resp.raise_for_status()
         return resp.json()
 
@@ -0,0 +1,288 @@
+# Offline USDA FoodData Central store.
+# Imports the FDC bulk downloads (Foundation, SR Legacy, FNDDS; CSV or JSON)
+# into a compact SQLite file, then serves search_foods() in-process from an
+# inverted token index so USDAIngredientRetriever can score without HTTP.
+#
+# Build the store once:
+#   python -m AI.usda_local import FoodData_Central_sr_legacy_food_csv_2018-04 \
+#       FoodData_Central_foundation_food_json_2024-10-31.json --out AI/usda_local.sqlite3
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_PATH = os.path.join(os.path.dirname(__file__), "usda_local.sqlite3")
+
+# bulk-download data_type values → the names the search API uses
+_CSV_DATA_TYPES = {
+    "foundation_food": "Foundation",
+    "sr_legacy_food": "SR Legacy",
+    "survey_fndds_food": "Survey (FNDDS)",
+}
+_JSON_ROOT_KEYS = ("FoundationFoods", "SRLegacyFoods", "SurveyFoods")
+
+# FDC nutrient ids we keep; Foundation foods often only carry Atwater energy
+_ENERGY_IDS = (1008, 2047, 2048)
+_MACRO_IDS = {1003: "protein_g", 1005: "carbs_g", 1004: "fats_g"}
+_KEPT_NUTRIENTS = set(_ENERGY_IDS) | set(_MACRO_IDS)
+
+# same ordering the reranker prefers, used to break ties before it sees them
+_DATASET_RANK = {"Foundation": 0, "SR Legacy": 1, "Survey (FNDDS)": 2}
+
+_SCHEMA = """
+DROP TABLE IF EXISTS foods;
+DROP TABLE IF EXISTS postings;
+CREATE TABLE foods (
+    fdc_id      INTEGER PRIMARY KEY,
+    data_type   TEXT NOT NULL,
+    description TEXT NOT NULL,
+    category    TEXT,
+    calories    REAL,
+    protein_g   REAL,
+    carbs_g     REAL,
+    fats_g      REAL
+);
+CREATE TABLE postings (
+    token  TEXT NOT NULL,
+    fdc_id INTEGER NOT NULL
+);
+"""
+
+
+def _tokenize(text: str) -> List[str]:
+    return [p for p in re.split(r"[^a-z0-9]+", (text or "").lower()) if p]
+
+
+def _token_variants(token: str) -> tuple[str, ...]:
+    if len(token) > 3 and token.endswith("es"):
+        return (token, token[:-2], token[:-1])
+    if len(token) > 2 and token.endswith("s"):
+        return (token, token[:-1])
+    return (token, token + "s")
+
+
+def _pick_energy(nutrients: Dict[int, float]) -> float | None:
+    for nid in _ENERGY_IDS:
+        if nutrients.get(nid):
+            return nutrients[nid]
+    return None
+
+
+# ---------------- import ----------------
+def _iter_csv_foods(folder: str) -> Iterator[dict]:
+    def _rows(name: str) -> Iterator[dict]:
+        path = os.path.join(folder, name)
+        if not os.path.exists(path):
+            return
+        with open(path, newline="", encoding="utf-8") as handle:
+            yield from csv.DictReader(handle)
+
+    categories: Dict[str, str] = {}
+    for row in _rows("food_category.csv"):
+        categories[row.get("id", "")] = row.get("description") or ""
+    wweia: Dict[str, str] = {}
+    for row in _rows("wweia_food_category.csv"):
+        wweia[row.get("wweia_food_category", "")] = row.get("wweia_food_category_description") or ""
+
+    foods: Dict[int, dict] = {}
+    for row in _rows("food.csv"):
+        data_type = _CSV_DATA_TYPES.get((row.get("data_type") or "").strip())
+        if not data_type:
+            continue
+        try:
+            fdc_id = int(row["fdc_id"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        cat_id = row.get("food_category_id") or ""
+        category = wweia.get(cat_id) if data_type == "Survey (FNDDS)" else categories.get(cat_id)
+        foods[fdc_id] = {
+            "fdc_id": fdc_id,
+            "data_type": data_type,
+            "description": (row.get("description") or "").strip(),
+            "category": category or cat_id or None,
+            "nutrients": {},
+        }
+
+    for row in _rows("food_nutrient.csv"):
+        try:
+            fdc_id = int(row["fdc_id"])
+            nid = int(row["nutrient_id"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if nid not in _KEPT_NUTRIENTS or fdc_id not in foods:
+            continue
+        try:
+            foods[fdc_id]["nutrients"][nid] = float(row.get("amount") or 0.0)
+        except (TypeError, ValueError):
+            continue
+
+    return iter(foods.values())
+
+
+def _iter_json_foods(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    for root in _JSON_ROOT_KEYS:
+        for food in data.get(root) or []:
+            data_type = food.get("dataType")
+            if data_type not in _DATASET_RANK or food.get("fdcId") is None:
+                continue
+            category = (food.get("foodCategory") or {}).get("description") or (
+                food.get("wweiaFoodCategory") or {}
+            ).get("wweiaFoodCategoryDescription")
+            nutrients: Dict[int, float] = {}
+            for node in food.get("foodNutrients") or []:
+                nid = (node.get("nutrient") or {}).get("id")
+                if nid in _KEPT_NUTRIENTS:
+                    try:
+                        nutrients[nid] = float(node.get("amount") or 0.0)
+                    except (TypeError, ValueError):
+                        continue
+            yield {
+                "fdc_id": int(food["fdcId"]),
+                "data_type": data_type,
+                "description": (food.get("description") or "").strip(),
+                "category": category,
+                "nutrients": nutrients,
+            }
+
+
+def build_local_store(sources: Sequence[str], out_path: str = DEFAULT_LOCAL_PATH) -> int:
+    """Import FDC bulk downloads (CSV folders or JSON files) into out_path."""
+    tmp = out_path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    conn.executescript(_SCHEMA)
+
+    imported = 0
+    for source in sources:
+        foods: Iterable[dict] = _iter_csv_foods(source) if os.path.isdir(source) else _iter_json_foods(source)
+        for food in foods:
+            nutrients = food["nutrients"]
+            calories = _pick_energy(nutrients)
+            if not food["description"] or not calories:
+                continue
+            conn.execute(
+                "INSERT OR REPLACE INTO foods VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    food["fdc_id"], food["data_type"], food["description"], food["category"],
+                    calories,
+                    nutrients.get(1003, 0.0), nutrients.get(1005, 0.0), nutrients.get(1004, 0.0),
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO postings VALUES (?, ?)",
+                ((tok, food["fdc_id"]) for tok in set(_tokenize(food["description"]))),
+            )
+            imported += 1
+        logger.info("Imported %s (running total %d foods)", source, imported)
+
+    conn.execute("CREATE INDEX postings_token ON postings (token)")
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    os.replace(tmp, out_path)
+    return imported
+
+
+# ---------------- search ----------------
+@dataclass(slots=True)
+class LocalFoodDataClient:
+    """Drop-in for USDAFoodDataClient.search_foods backed by the imported store."""
+
+    path: str = DEFAULT_LOCAL_PATH
+    _foods: Dict[int, dict] = field(default_factory=dict, init=False, repr=False)
+    _index: Dict[str, frozenset] = field(default_factory=dict, init=False, repr=False)
+    _loaded: bool = field(default=False, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def search_foods(
+        self,
+        query: str,
+        *,
+        page_size: int = 5,
+        data_types: Sequence[str] | None = None,
+    ) -> List[Dict]:
+        if not query:
+            return []
+        self._ensure_loaded()
+
+        # requireAllWords semantics; singular/plural forms count as the same word
+        candidates: set[int] | None = None
+        for token in set(_tokenize(query)):
+            ids: set[int] = set()
+            for variant in _token_variants(token):
+                ids.update(self._index.get(variant, ()))
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return []
+
+        allowed = set(data_types) if data_types else None
+        foods = [self._foods[i] for i in candidates or ()]
+        if allowed is not None:
+            foods = [f for f in foods if f["dataType"] in allowed]
+        foods.sort(key=lambda f: (f["_n_tokens"], _DATASET_RANK.get(f["dataType"], 9), f["fdcId"]))
+        return foods[:page_size]
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            try:
+                for fdc_id, data_type, desc, category, kcal, protein, carbs, fats in conn.execute(
+                    "SELECT fdc_id, data_type, description, category, calories, protein_g, carbs_g, fats_g FROM foods"
+                ):
+                    # shaped like a /foods/search hit so the retriever's scoring is reused as-is
+                    self._foods[fdc_id] = {
+                        "fdcId": fdc_id,
+                        "dataType": data_type,
+                        "description": desc,
+                        "foodCategory": category,
+                        "foodNutrients": [
+                            {"nutrientId": 1008, "value": kcal},
+                            {"nutrientId": 1003, "value": protein},
+                            {"nutrientId": 1005, "value": carbs},
+                            {"nutrientId": 1004, "value": fats},
+                        ],
+                        "_n_tokens": len(_tokenize(desc)),
+                    }
+                postings: Dict[str, List[int]] = {}
+                for token, fdc_id in conn.execute("SELECT token, fdc_id FROM postings"):
+                    postings.setdefault(token, []).append(fdc_id)
+                self._index = {tok: frozenset(ids) for tok, ids in postings.items()}
+            finally:
+                conn.close()
+            logger.info("Loaded %d local USDA foods from %s", len(self._foods), self.path)
+            self._loaded = True
+
+
+def _main(argv: Sequence[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Local USDA FoodData Central store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="build the store from FDC bulk downloads")
+    imp.add_argument("sources", nargs="+", help="CSV download folders or JSON download files")
+    imp.add_argument("--out", default=DEFAULT_LOCAL_PATH, help="store path (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    count = build_local_store(args.sources, args.out)
+    print(f"Imported {count} foods into {args.out}")
+
+
+if __name__ == "__main__":
+    _main()
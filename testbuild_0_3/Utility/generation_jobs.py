@@ -0,0 +1,270 @@
+# Background meal-plan generation.
+# Jobs are rows in a local SQLite file, so any gunicorn worker on the host can
+# answer GET /jobs/<id>; the generation itself runs in whichever worker accepted
+# the POST, on a small thread pool or, for async runners, on one event loop thread.
+# The same file also holds forms handed from the POST to the streaming GET.
+
+import asyncio
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_JOBS_PATH = os.path.join(os.path.dirname(__file__), "generation_jobs.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id         TEXT PRIMARY KEY,
+    user_id    INTEGER,
+    owner      TEXT,
+    status     TEXT NOT NULL,
+    stage      TEXT,
+    requested  INTEGER NOT NULL DEFAULT 0,
+    completed  INTEGER NOT NULL DEFAULT 0,
+    payload    TEXT,
+    result     TEXT,
+    error      TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated_at);
+"""
+
+_STASH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stashed_forms (
+    token      TEXT PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    payload    TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# queued -> running -> done | failed
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_UPDATABLE = {"status", "stage", "requested", "completed", "result", "error", "payload"}
+
+
+class GenerationJobQueue:
+    """SQLite job table plus a lazily started worker pool.
+
+    runner(job_id, payload, report) does the work; report(stage=..., completed=...)
+    records progress, and whatever runner returns is stored as the job result.
+    A plain runner gets one pool thread per job (`workers` threads). A coroutine
+    runner is awaited on a single event-loop thread instead, so a job waiting on
+    the model holds no thread; `workers` then caps how many jobs run at once.
+    The payload is only kept until the job finishes. `owner` is an opaque token
+    the caller checks before showing a job to anyone.
+    A queued or running job with no progress for stale_seconds (e.g. its worker
+    process restarted) is reported as failed.
+    """
+
+    def __init__(self, runner, path=DEFAULT_JOBS_PATH, workers=2, retention_seconds=24 * 3600.0, stale_seconds=600.0):
+        self.runner = runner
+        self.path = path
+        self.workers = max(1, int(workers))
+        self.retention_seconds = retention_seconds
+        self.stale_seconds = stale_seconds
+        self._local = threading.local()
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._loop = None
+        self._loop_pid = None
+        self._slots = None
+
+    # ---------------- public API ----------------
+    def submit(self, user_id, payload, requested=0, owner=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO jobs (id, user_id, owner, status, stage, requested, payload, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, user_id, owner, QUEUED, "queued", int(requested or 0), json.dumps(payload), now, now),
+        )
+        conn.execute("DELETE FROM jobs WHERE updated_at < ?", (now - self.retention_seconds,))
+        if inspect.iscoroutinefunction(self.runner):
+            asyncio.run_coroutine_threadsafe(self._run_async(job_id, payload), self._event_loop())
+        else:
+            self._executor().submit(self._run, job_id, payload)
+        return job_id
+
+    def get(self, job_id):
+        row = self._connect().execute(
+            "SELECT id, user_id, owner, status, stage, requested, completed, result, error, created_at, updated_at "
+            "FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "user_id", "owner", "status", "stage", "requested", "completed", "result", "error", "created_at", "updated_at")
+        job = dict(zip(keys, row))
+        if job["status"] in (QUEUED, RUNNING) and time.time() - job["updated_at"] > self.stale_seconds:
+            # nobody is working on it any more; the pool that owned it is gone or wedged
+            error = "job stopped responding"
+            self.update(job_id, status=FAILED, stage="failed", error=error, payload=None)
+            job.update(status=FAILED, stage="failed", error=error)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def update(self, job_id, **fields):
+        unknown = set(fields) - _UPDATABLE
+        if unknown:
+            raise ValueError(f"unknown job fields: {sorted(unknown)}")
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], default=str)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._connect().execute(
+            f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ?",
+            (*fields.values(), time.time(), job_id),
+        )
+
+    # ---------------- helpers ----------------
+    def _report(self, job_id):
+        def report(**progress):
+            try:
+                self.update(job_id, **progress)
+            except sqlite3.Error:
+                logging.exception("Failed to record progress for job %s", job_id)
+        return report
+
+    def _claim(self, job_id):
+        return self._connect().execute(
+            "UPDATE jobs SET status = ?, stage = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (RUNNING, "starting", time.time(), job_id, QUEUED),
+        ).rowcount
+
+    def _finish(self, job_id, result):
+        # the payload is the user's form (biometrics, allergies); drop it once finished
+        self.update(job_id, status=DONE, stage="done", result=result, payload=None)
+
+    def _fail(self, job_id, exc):
+        logging.error("Generation job %s failed", job_id, exc_info=exc)
+        try:
+            self.update(job_id, status=FAILED, stage="failed", error=str(exc) or exc.__class__.__name__, payload=None)
+        except Exception:
+            # left queued/running; get() reports it failed once it goes stale
+            logging.exception("Failed to mark job %s as failed", job_id)
+
+    def _run(self, job_id, payload):
+        # any failure, including the status writes themselves, must end in FAILED
+        # or the poller would wait on this job forever
+        try:
+            if not self._claim(job_id):
+                # already given up on as stale while it sat in the queue
+                return
+            self._finish(job_id, self.runner(job_id, payload, self._report(job_id)))
+        except Exception as exc:
+            self._fail(job_id, exc)
+
+    async def _run_async(self, job_id, payload):
+        # same steps as _run; the SQLite writes go to a thread so they never block the loop
+        async with self._slots:
+            try:
+                if not await asyncio.to_thread(self._claim, job_id):
+                    return
+                result = await self.runner(job_id, payload, self._report(job_id))
+                await asyncio.to_thread(self._finish, job_id, result)
+            except Exception as exc:
+                await asyncio.to_thread(self._fail, job_id, exc)
+
+    def _executor(self):
+        # gunicorn forks after import; each worker process gets its own pool
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="meal-job")
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _event_loop(self):
+        # one loop thread per worker process, started on the first async job
+        with self._pool_lock:
+            if self._loop is None or self._loop_pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._loop_pid = os.getpid()
+                self._slots = asyncio.Semaphore(self.workers)
+                threading.Thread(target=self._loop.run_forever, name="meal-job-loop", daemon=True).start()
+            return self._loop
+
+    def _connect(self):
+        # one connection per thread and per process, like the USDA fact cache
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            # job files from before owner tokens existed
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+
+class FormStash:
+    """One-time, short-lived server-side copies of a submitted form.
+
+    put() returns a token to hand to the browser instead of the form itself;
+    take() returns the form once, for the same owner, and deletes it.
+    """
+
+    def __init__(self, path=DEFAULT_JOBS_PATH, ttl_seconds=300.0):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+
+    def put(self, owner, payload):
+        token = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO stashed_forms (token, owner, payload, created_at) VALUES (?, ?, ?, ?)",
+            (token, owner, json.dumps(payload), now),
+        )
+        conn.execute("DELETE FROM stashed_forms WHERE created_at < ?", (now - self.ttl_seconds,))
+        return token
+
+    def take(self, token, owner):
+        if not token or not owner:
+            return None
+        conn = self._connect()
+        # the delete is the claim, so two requests racing on one token cannot both win
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT owner, payload, created_at FROM stashed_forms WHERE token = ?", (token,)
+            ).fetchone()
+            if row is None or row[0] != owner:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("DELETE FROM stashed_forms WHERE token = ?", (token,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if time.time() - row[2] > self.ttl_seconds:
+            return None
+        return json.loads(row[1])
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_STASH_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
@@ -1,10 +1,18 @@
+import ast
+import base64
 import json
 import logging
+import os
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
-from sqlalchemy import text
+from sqlalchemy import and_, func, or_, text
+from sqlalchemy.orm import aliased
 
 from User_Auth.database import db
+from Classes.Meal import Meal
+from Classes.MealCollection import MealCollection
 # table for holding all recipes generated by our system on behalf of another user
 class SavedRecipe(db.Model):
     __tablename__ = 'generated_recipes'
@@ -36,6 +44,36 @@ class SavedRecipe(db.Model):
 
 
 
+# one row per ingredient of a saved recipe, so ingredient queries (shopping
+# lists, "meals using X") run in SQL instead of re-parsing the Text blobs above
+class RecipeIngredient(db.Model):
+    __tablename__ = 'recipe_ingredients'
+
+    meal_id = db.Column(db.String(80), db.ForeignKey('generated_recipes.meal_id', ondelete='CASCADE'), primary_key=True, nullable=False)
+    position = db.Column(db.Integer, primary_key=True, nullable=False)
+
+    # copied from the recipe so per-user ingredient lookups stay on one index
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    name = db.Column(db.String(255), nullable=False)
+    name_key = db.Column(db.String(255), nullable=False)  # lower-cased name used for grouping
+    grams = db.Column(db.Float, nullable=True)
+    quantity = db.Column(db.Float, nullable=True)
+    unit = db.Column(db.String(40), nullable=True)
+    calories = db.Column(db.Float, nullable=True)
+    fdc_id = db.Column(db.Integer, nullable=True)
+    note = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (
+        db.Index('recipe_ingredients_user_name_idx', 'user_id', 'name_key'),
+        db.Index('recipe_ingredients_fdc_idx', 'fdc_id'),
+    )
+
+    def __repr__(self):
+        return f"<RecipeIngredient meal_id={self.meal_id} position={self.position} name='{self.name}'>"
+
+
+
 #table for storing the meals users have saved to a given collection
 class MealCollections(db.Model):
     __tablename__ = 'collection_meals'
@@ -51,6 +89,17 @@ class MealCollections(db.Model):
         return f"<MealCollections meal_id={self.meal_id} user_id={self.user_id} collection='{self.collection_name}'>"
 
 
+# per-user change counter for saved meals and collection links; bumped in the
+# same transaction as every write so other workers' caches can tell they are stale
+class SavedMealsVersion(db.Model):
+    __tablename__ = "saved_meal_versions"
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True, nullable=False)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<SavedMealsVersion user_id={self.user_id} version={self.version}>"
+
+
 # stores all collections created by users
 class CollectionInfo(db.Model):
     __tablename__ = "collections"
@@ -102,6 +151,41 @@ def getUserMeals(userID):
     return mealCollections
 
 
+# saved meals are listed newest first; pages are cut on (created_on, meal_id)
+# so a page costs the same no matter how many recipes came before it
+SAVED_MEALS_PAGE_SIZE = int(os.getenv("SAVED_MEALS_PAGE_SIZE", "24") or 24)
+
+
+def encodeMealCursor(record):
+    raw = f"{record.created_on.isoformat()}|{record.meal_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+# returns (created_on, meal_id), or None for a missing or unreadable cursor
+def decodeMealCursor(cursor):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_on, meal_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_on), meal_id
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _mealsPageQuery(userID, cursor, limit, model=SavedRecipe):
+    query = db.session.query(model).filter(model.user_id == userID)
+    position = decodeMealCursor(cursor)
+    if position is not None:
+        created_on, meal_id = position
+        query = query.filter(or_(
+            model.created_on < created_on,
+            and_(model.created_on == created_on, model.meal_id < meal_id),
+        ))
+    # one extra row tells us whether another page exists
+    return query.order_by(model.created_on.desc(), model.meal_id.desc()).limit(limit + 1)
+
+
 def getAllMeals(userID):
     # Legacy raw SQL (pre-Postgres fix):
     # q2 = f'''select * from generated_meals where user_id="{userID}'''
@@ -122,6 +206,229 @@ def getAllMeals(userID):
         .all()
     )
 
+# decodes a Text column written by _serialize_field (JSON, or str() of a list for old rows)
+def _deserialize_list(value):
+    if value in (None, ''):
+        return []
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str):
+        text = value.strip()
+        if not text:
+            return []
+        for loader in (json.loads, ast.literal_eval):
+            try:
+                parsed = loader(text)
+            except Exception:
+                continue
+            if isinstance(parsed, list):
+                return parsed
+            return [parsed]
+        return [text]
+    return [value]
+
+
+# per-process cache of each user's decoded saved meals and collections;
+# entries are checked against the user's saved_meal_versions row so writes from
+# other workers are noticed, and dropped outright when this process writes
+_SAVED_MEALS_CACHE_SIZE = int(os.getenv("SAVED_MEALS_CACHE_SIZE", "64") or 64)
+_saved_meals_cache = OrderedDict()
+_saved_meals_lock = threading.Lock()
+
+
+def invalidateSavedMeals(userID):
+    with _saved_meals_lock:
+        _saved_meals_cache.pop(userID, None)
+
+
+# call inside the write's transaction, before commit
+def _bumpSavedMealsVersion(userID):
+    db.session.execute(
+        text(
+            """
+            insert into saved_meal_versions (user_id, version)
+            values (:user_id, 1)
+            on conflict (user_id) do update set version = saved_meal_versions.version + 1
+            """
+        ),
+        {"user_id": userID},
+    )
+
+
+def _savedMealsSignature(userID):
+    version = db.session.execute(
+        text("select version from saved_meal_versions where user_id = :user_id"),
+        {"user_id": userID},
+    ).scalar()
+    return version or 0
+
+
+def _buildSavedMeals(userID, cursor, limit):
+    # one round trip: a page of saved recipes plus the collections each belongs to
+    page = aliased(SavedRecipe, _mealsPageQuery(userID, cursor, limit).subquery())
+    rows = (
+        db.session.query(page, MealCollections.collection_name)
+        .outerjoin(
+            MealCollections,
+            and_(MealCollections.meal_id == page.meal_id, MealCollections.user_id == page.user_id),
+        )
+        .order_by(page.created_on.desc(), page.meal_id.desc())
+        .all()
+    )
+
+    meals = []
+    meal_lookup = {}
+    collections = {}
+    next_cursor = None
+    ingredients = _ingredientsFor({record.meal_id for record, _ in rows})
+    for record, collection_name in rows:
+        meal = meal_lookup.get(record.meal_id)
+        if meal is None:
+            if len(meals) == limit:
+                next_cursor = encodeMealCursor(last_record)
+                break
+            meal = Meal(
+                record.meal_type,
+                record.recipe_name,
+                ingredients.get(record.meal_id) or _deserialize_list(record.ingredients),
+                record.calories or 0,
+                _deserialize_list(record.instructions),
+                record.carbs or 0,
+                record.fats or 0,
+                record.protein or 0,
+            )
+            setattr(meal, 'id', record.meal_id)
+            meals.append(meal)
+            meal_lookup[record.meal_id] = meal
+            last_record = record
+        if collection_name:
+            collection = collections.setdefault(collection_name, MealCollection([], collection_name))
+            if meal not in collection.meals:
+                collection.meals.append(meal)
+    return meals, list(collections.values()), next_cursor
+
+
+# pages kept per cached user (first page plus a few "load more" pages)
+_SAVED_MEALS_PAGES_PER_USER = 8
+
+
+# returns (meals, collections, next_cursor) as Meal / MealCollection objects for one
+# page of the saved-meal views; collections only hold meals from that page
+def loadSavedMeals(userID, cursor=None, limit=None):
+    if userID is None:
+        return [], [], None
+    limit = limit or SAVED_MEALS_PAGE_SIZE
+    page_key = (cursor or "", limit)
+    signature = _savedMealsSignature(userID)
+    with _saved_meals_lock:
+        cached = _saved_meals_cache.get(userID)
+        if cached is not None and cached[0] == signature and page_key in cached[1]:
+            _saved_meals_cache.move_to_end(userID)
+            meals, collections, next_cursor = cached[1][page_key]
+            return list(meals), list(collections), next_cursor
+
+    result = _buildSavedMeals(userID, cursor, limit)
+    if _SAVED_MEALS_CACHE_SIZE > 0:
+        with _saved_meals_lock:
+            cached = _saved_meals_cache.get(userID)
+            pages = cached[1] if cached is not None and cached[0] == signature else {}
+            pages[page_key] = result
+            while len(pages) > _SAVED_MEALS_PAGES_PER_USER:
+                pages.pop(next(iter(pages)))
+            _saved_meals_cache[userID] = (signature, pages)
+            _saved_meals_cache.move_to_end(userID)
+            while len(_saved_meals_cache) > _SAVED_MEALS_CACHE_SIZE:
+                _saved_meals_cache.popitem(last=False)
+    meals, collections, next_cursor = result
+    return list(meals), list(collections), next_cursor
+
+# shopping-list totals for the given meals:
+# ([(name, unit, quantity)], {name: times listed without a quantity})
+def getShoppingListTotals(userID, mealIDs=None):
+    if userID is None:
+        return [], {}
+    meals = db.session.query(SavedRecipe.meal_id).filter(SavedRecipe.user_id == userID)
+    if mealIDs is not None:
+        ids = sorted({str(mid) for mid in mealIDs if mid})
+        if not ids:
+            return [], {}
+        meals = meals.filter(or_(SavedRecipe.meal_id.in_(ids), SavedRecipe.recipe_name.in_(ids)))
+
+    unit_key = func.lower(func.coalesce(RecipeIngredient.unit, ''))
+    unmeasured = RecipeIngredient.quantity.is_(None)
+    rows = (
+        db.session.query(
+            RecipeIngredient.name_key,
+            unit_key,
+            func.min(RecipeIngredient.name),
+            func.min(func.coalesce(RecipeIngredient.unit, '')),
+            func.sum(RecipeIngredient.quantity),
+            func.count(),
+        )
+        .filter(RecipeIngredient.user_id == userID, RecipeIngredient.meal_id.in_(meals.scalar_subquery()))
+        .group_by(RecipeIngredient.name_key, unit_key, unmeasured)
+        .all()
+    )
+
+    groups = {}
+    for name_key, unit_key_value, name, unit, quantity, count in rows:
+        groups[(name_key, unit_key_value, quantity is None)] = [name, unit, quantity, count]
+
+    # recipes saved before recipe_ingredients existed and not backfilled yet:
+    # decode their blobs so they still make the list
+    has_rows = db.session.query(RecipeIngredient.meal_id).filter(RecipeIngredient.meal_id == SavedRecipe.meal_id).exists()
+    for record in SavedRecipe.query.filter(SavedRecipe.meal_id.in_(meals.scalar_subquery()), ~has_rows).all():
+        decoded = _ingredientRows(
+            userID,
+            record.meal_id,
+            _deserialize_list(record.ingredients),
+            _deserialize_list(record.ingredient_amounts),
+            _deserialize_list(record.ingredient_units),
+        )
+        for row in decoded:
+            key = (row.name_key, (row.unit or '').lower(), row.quantity is None)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [row.name, row.unit or '', row.quantity, 1]
+                continue
+            group[0] = min(group[0], row.name)
+            group[1] = min(group[1], row.unit or '')
+            if row.quantity is not None:
+                group[2] = float(group[2]) + row.quantity
+            group[3] += 1
+
+    totals = []
+    uncounted = {}
+    for name, unit, quantity, count in groups.values():
+        if quantity is None:
+            uncounted[name] = uncounted.get(name, 0) + count
+        else:
+            totals.append((name, unit, float(quantity)))
+    return totals, uncounted
+
+# most common ingredient names across the user's latest saved recipes
+# (used to prefetch USDA facts before generating a new plan)
+def getFrequentIngredients(userID, limit=8, recent=20):
+    if userID is None:
+        return []
+    latest = (
+        db.session.query(SavedRecipe.meal_id)
+        .filter(SavedRecipe.user_id == userID)
+        .order_by(SavedRecipe.created_on.desc(), SavedRecipe.meal_id.desc())
+        .limit(recent)
+        .subquery()
+    )
+    uses = func.count(func.distinct(RecipeIngredient.meal_id))
+    rows = (
+        db.session.query(RecipeIngredient.name_key, uses)
+        .filter(RecipeIngredient.user_id == userID, RecipeIngredient.meal_id.in_(db.session.query(latest.c.meal_id)))
+        .group_by(RecipeIngredient.name_key)
+        .order_by(uses.desc(), RecipeIngredient.name_key)
+        .limit(limit)
+        .all()
+    )
+    return [name for name, _ in rows]
+
 # adds new meal to a collection if it hasnt been already
 def addMealToCollection(userID,collectionName,mealID):
     meal2Add=MealCollections(user_id=userID,collection_name=collectionName,meal_id=mealID)
@@ -137,11 +444,13 @@ def addMealToCollection(userID,collectionName,mealID):
     # db.session.commit()
     # db.session.close()
     try:
+        _bumpSavedMealsVersion(userID)
         db.session.commit()
     except Exception:
         db.session.rollback()
         logging.exception("Failed to add meal %s to collection %s", mealID, collectionName)
         raise
+    invalidateSavedMeals(userID)
     return True
 
 
@@ -191,6 +500,15 @@ def _serialize_field(value):
         return str(value)
 
 
+def _safe_float(value):
+    try:
+        if value in (None, ""):
+            return None
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
 def _safe_int(value):
     try:
         if value in (None, ""):
@@ -200,11 +518,114 @@ def _safe_int(value):
         return None
 
 
+# recipe_ingredients rows for one recipe, from its decoded ingredient list
+# (quantities and units fall back to the parallel ingredient_amounts/units lists)
+def _ingredientRows(userID, mealID, ingredients, quants=None, units=None):
+    quants = quants or []
+    units = units or []
+    rows = []
+    for position, entry in enumerate(ingredients or []):
+        if isinstance(entry, dict):
+            name = (
+                entry.get('name')
+                or entry.get('ingredient')
+                or entry.get('item')
+                or entry.get('raw')
+            )
+            quantity = entry.get('quantity') or entry.get('qty') or entry.get('amount')
+            unit = entry.get('unit') or entry.get('units')
+            grams = _safe_float(entry.get('grams') or entry.get('weight_g'))
+            calories = _safe_float(entry.get('calories') or entry.get('estimated_calories'))
+            fdc_id = _safe_int(entry.get('fdc_id'))
+            note = entry.get('note')
+        else:
+            name, quantity, unit, grams, calories, fdc_id, note = entry, None, None, None, None, None, None
+        if quantity in (None, "") and position < len(quants):
+            quantity = quants[position]
+        if not unit and position < len(units):
+            unit = units[position]
+
+        name = str(name or '').strip()
+        if not name:
+            continue
+        rows.append(RecipeIngredient(
+            meal_id=mealID,
+            position=position,
+            user_id=userID,
+            name=name[:255],
+            name_key=name.lower()[:255],
+            grams=grams,
+            # 0 is treated like a missing amount, as the shopping list always has
+            quantity=_safe_float(quantity) or None,
+            unit=(str(unit).strip()[:40] or None) if unit else None,
+            calories=calories,
+            fdc_id=fdc_id,
+            note=str(note) if note not in (None, "") else None,
+        ))
+    return rows
+
+
+# ingredient dicts per meal id, in recipe order, read from recipe_ingredients
+def _ingredientsFor(mealIDs):
+    if not mealIDs:
+        return {}
+    rows = (
+        RecipeIngredient.query
+        .filter(RecipeIngredient.meal_id.in_(sorted(mealIDs)))
+        .order_by(RecipeIngredient.meal_id, RecipeIngredient.position)
+        .all()
+    )
+    found = {}
+    for row in rows:
+        found.setdefault(row.meal_id, []).append({
+            "name": row.name,
+            "quantity": row.quantity,
+            "unit": row.unit or "",
+            "grams": row.grams,
+            "calories": row.calories,
+            "fdc_id": row.fdc_id,
+            "note": row.note,
+        })
+    return found
+
+
+# fills recipe_ingredients for saved recipes that have none yet; returns how many were filled
+def backfillRecipeIngredients(batch_size=500):
+    has_rows = db.session.query(RecipeIngredient.meal_id).filter(RecipeIngredient.meal_id == SavedRecipe.meal_id).exists()
+    filled = 0
+    last_id = ""
+    while True:
+        batch = (
+            SavedRecipe.query
+            .filter(SavedRecipe.meal_id > last_id, SavedRecipe.ingredients.isnot(None), ~has_rows)
+            .order_by(SavedRecipe.meal_id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for record in batch:
+            rows = _ingredientRows(
+                record.user_id,
+                record.meal_id,
+                _deserialize_list(record.ingredients),
+                _deserialize_list(record.ingredient_amounts),
+                _deserialize_list(record.ingredient_units),
+            )
+            if rows:
+                db.session.add_all(rows)
+                filled += 1
+        last_id = batch[-1].meal_id
+        db.session.commit()
+    return filled
+
+
 def saveNewMeals(userID, newMeals, units=None, quants=None):
     meals_payload = (newMeals or {}).get("meals") or []
     units = units or []
     quants = quants or []
     saved_any = False
+    ingredient_rows = {}
 
         # db.session.add(newMeal)
         # db.session.commit()
@@ -234,15 +655,23 @@ def saveNewMeals(userID, newMeals, units=None, quants=None):
         )
 
         db.session.merge(newMeal)
+        ingredient_rows[meal_id] = _ingredientRows(userID, meal_id, meal.get("ingredients"), quant_payload, unit_payload)
         saved_any = True
 
     if saved_any:
         try:
+            # recipes first so the child rows' foreign keys resolve; a re-save replaces its rows
+            db.session.flush()
+            RecipeIngredient.query.filter(RecipeIngredient.meal_id.in_(list(ingredient_rows))).delete(synchronize_session=False)
+            for rows in ingredient_rows.values():
+                db.session.add_all(rows)
+            _bumpSavedMealsVersion(userID)
             db.session.commit()
         except Exception:
             db.session.rollback()
             logging.exception("Failed to save new meals for user %s", userID)
             raise
+        invalidateSavedMeals(userID)
     return saved_any
 
 
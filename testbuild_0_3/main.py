@@ -1,9 +1,11 @@
 # load environment variables first
 from __future__ import annotations
 
-import ast
+import asyncio
 import json
 import os
+from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Any, Mapping, Optional
 from pathlib import Path
 from dotenv import load_dotenv
@@ -13,12 +15,20 @@ from dotenv import load_dotenv
 load_dotenv()
 load_dotenv(Path(__file__).resolve().parent / ".env")
 
-from flask import Flask, jsonify, request, render_template, session, redirect, url_for
+from werkzeug.datastructures import MultiDict
+from flask import Flask, Response, jsonify, request, render_template, session, redirect, stream_with_context, url_for
 import logging
 import re
+import secrets
+import threading
+import click
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import text
 from Utility.ingredient_utils import normalize_meals
-from Utility.mealSaver import getCollectionMeals,saveNewMeals,generatemealIDs,addMealToCollection,createNewCollection,getCollections,getUserMeals,getAllMeals
+from Utility.mealSaver import saveNewMeals,generatemealIDs,addMealToCollection,createNewCollection,getUserMeals,getFrequentIngredients,loadSavedMeals,getShoppingListTotals,backfillRecipeIngredients
+from Utility.generation_jobs import DEFAULT_JOBS_PATH, DONE, FormStash, GenerationJobQueue
 
 # Database
 from User_Auth.database import db
@@ -34,8 +44,8 @@ from Classes.GroceryList import GroceryList
 from Classes.MealCollection import MealCollection
 
 # AI imports
-from AI.promptGen import generate_prompt
-from AI.callModel import call_model
+from AI.promptGen import approx_tokens, generate_prompt, generate_prompt_sections, join_prompt_sections, section_token_counts
+from AI.callModel import call_model, call_model_async, stream_model
 from AI import constraints_store as cs
 from AI import constraints_db as cdb
 from AI.retriever import (
@@ -45,6 +55,8 @@ from AI.retriever import (
 )
 from AI.retrieval_contract import IngredientFact, RetrievalBatch
 from AI.usda_client import USDAFoodDataClient
+from AI.fact_cache import DEFAULT_CACHE_PATH, SQLiteFactCache
+from AI.usda_local import DEFAULT_LOCAL_PATH, LocalFoodDataClient
 
 # Routes
 from Feed.feed import register_feed_routes
@@ -97,6 +109,21 @@ _CALORIE_SCOPE_MAP = {
 _CALORIE_ABOUT_TOLERANCE = float(os.getenv("CALORIE_ABOUT_TOLERANCE", "0.20"))  # default ±20%
 _CALORIE_MIN_DELTA = int(os.getenv("CALORIE_MIN_DELTA", "200"))  # fallback slack when targets are small (~±200 kcal)
 
+# MEAL_STREAMING=on streams meals to the results page over SSE as each one is ready
+_STREAMING_ENABLED = (os.getenv("MEAL_STREAMING", "off").strip().lower() == "on")
+
+# MEAL_PLAN_FANOUT=daypart issues one concurrent model call per meal type
+# (split further into chunks of MEAL_PLAN_FANOUT_CHUNK meals when set)
+_FANOUT_MODE = os.getenv("MEAL_PLAN_FANOUT", "off").strip().lower()
+_FANOUT_CHUNK = int(os.getenv("MEAL_PLAN_FANOUT_CHUNK", "0") or 0)
+_FANOUT_WORKERS = int(os.getenv("MEAL_PLAN_FANOUT_WORKERS", "3") or 3)
+
+# MEAL_PLAN_JOBS=on queues generation on a background worker and the results page polls /jobs/<id>
+_JOBS_ENABLED = (os.getenv("MEAL_PLAN_JOBS", "off").strip().lower() == "on")
+if _STREAMING_ENABLED and _JOBS_ENABLED:
+    logging.warning("MEAL_STREAMING and MEAL_PLAN_JOBS are both on; streaming wins and jobs are not used")
+    _JOBS_ENABLED = False
+
 _AUTO_FAVORITE_LIMIT = 4
 _VARIETY_PRESETS = [
     {
@@ -118,6 +145,25 @@ _VARIETY_PRESETS = [
 ]
 
 
+# MEAL_PREFETCH=off skips seeding lookups from, and warming, the USDA fact cache for likely ingredients
+_PREFETCH_ENABLED = os.getenv("MEAL_PREFETCH", "on").strip().lower() != "off"
+_PREFETCH_LIMIT = int(os.getenv("MEAL_PREFETCH_LIMIT", "8") or 8)
+
+# staples the model reaches for under each diet; filtered against the banned list per request.
+# Only used to warm the fact cache, never shown to the model.
+_DIET_STAPLES = {
+    "vegan": ["tofu", "chickpeas", "lentils", "brown rice", "spinach", "olive oil"],
+    "vegetarian": ["eggs", "greek yogurt", "chickpeas", "brown rice", "spinach", "olive oil"],
+    "pescatarian": ["salmon", "shrimp", "eggs", "brown rice", "spinach", "olive oil"],
+    "keto": ["eggs", "avocado", "chicken thigh", "salmon", "spinach", "olive oil"],
+    "low-carb": ["chicken breast", "eggs", "salmon", "broccoli", "spinach", "olive oil"],
+    "paleo": ["chicken breast", "sweet potato", "eggs", "avocado", "broccoli", "olive oil"],
+    "gluten-free": ["chicken breast", "quinoa", "brown rice", "eggs", "broccoli", "olive oil"],
+    "dairy-free": ["chicken breast", "brown rice", "eggs", "broccoli", "spinach", "olive oil"],
+}
+_DEFAULT_STAPLES = ["chicken breast", "eggs", "brown rice", "broccoli", "spinach", "olive oil"]
+
+
 def _normalize_activity_level(raw: Optional[str]) -> str:
     if not raw:
         return "moderate"
@@ -266,25 +312,19 @@ def _select_variety_terms(existing_terms: list[str], desired_counts: Mapping[str
     return auto_terms, preset.get('label'), True
 
 
-def _deserialize_list(value):
-    if value in (None, ''):
-        return []
-    if isinstance(value, list):
-        return value
-    if isinstance(value, str):
-        text = value.strip()
-        if not text:
-            return []
-        for loader in (json.loads, ast.literal_eval):
-            try:
-                parsed = loader(text)
-            except Exception:
-                continue
-            if isinstance(parsed, list):
-                return parsed
-            return [parsed]
-        return [text]
-    return [value]
+def _init_fact_cache() -> SQLiteFactCache | None:
+    if (os.getenv("USDA_CACHE") or "on").strip().lower() == "off":
+        return None
+    path = (os.getenv("USDA_CACHE_PATH") or DEFAULT_CACHE_PATH).strip()
+    cache = SQLiteFactCache(
+        path=path,
+        ttl_seconds=float(os.getenv("USDA_CACHE_TTL", "604800") or 604800),
+        max_entries=int(os.getenv("USDA_CACHE_MAX_ENTRIES", "5000") or 5000),
+    )
+    logging.info("USDA lookup cache at %s", path)
+    return cache
+
+
 def _init_retriever() -> StubIngredientRetriever | USDAIngredientRetriever:
     choice = (os.getenv("INGREDIENT_RETRIEVER") or "stub").strip().lower()
     if choice == "usda":
@@ -292,10 +332,22 @@ def _init_retriever() -> StubIngredientRetriever | USDAIngredientRetriever:
         if not api_key:
             logging.warning("INGREDIENT_RETRIEVER=usda but USDA_API_KEY is not set; falling back to stub data")
         else:
-            client = USDAFoodDataClient(api_key=api_key)
+            client = USDAFoodDataClient(
+                api_key=api_key,
+                pool_size=int(os.getenv("USDA_POOL_SIZE", "8") or 8),
+                max_retries=int(os.getenv("USDA_MAX_RETRIES", "2") or 2),
+            )
             page_size = int(os.getenv("USDA_PAGE_SIZE", "3") or 3)
             logging.info("Using USDAIngredientRetriever (page_size=%s)", page_size)
-            return USDAIngredientRetriever(client=client, page_size=page_size)
+            return USDAIngredientRetriever(client=client, page_size=page_size, cache=_init_fact_cache())
+    elif choice == "local":
+        path = (os.getenv("USDA_LOCAL_PATH") or DEFAULT_LOCAL_PATH).strip()
+        if not os.path.exists(path):
+            logging.warning("INGREDIENT_RETRIEVER=local but %s does not exist (run `python -m AI.usda_local import ...`); falling back to stub data", path)
+        else:
+            page_size = int(os.getenv("USDA_PAGE_SIZE", "8") or 8)
+            logging.info("Using local USDA store %s (page_size=%s)", path, page_size)
+            return USDAIngredientRetriever(client=LocalFoodDataClient(path=path), page_size=page_size)
 
     logging.info("Using StubIngredientRetriever")
     return StubIngredientRetriever(DEFAULT_STUB_STORE)
@@ -392,6 +444,7 @@ def _extract_ingredient_parts(ingredient) -> tuple[float | None, str | None, str
     return grams, 'g' if grams is not None else None, name
 
 
+@lru_cache(maxsize=4096)
 def _normalize_term(name: str) -> str:
     text = (name or '').lower()
     text = re.sub(r'\([^)]*\)', ' ', text)
@@ -413,34 +466,95 @@ def _term_tokens(term: str) -> set[str]:
     return tokens
 
 
-def _best_cached_fact(term: str, fact_cache: dict[str, IngredientFact]) -> IngredientFact | None:
-    if not fact_cache:
-        return None
+class FactIndex(MutableMapping):
+    """Fact cache keyed by ingredient term with a token -> keys inverted index.
+
+    Token sets are computed once per key, so a fuzzy lookup only touches keys
+    sharing a token with the term instead of re-normalizing every key.
+    """
+
+    def __init__(self, facts: Mapping[str, IngredientFact] | None = None) -> None:
+        self._facts: dict[str, IngredientFact] = {}
+        self._tokens: dict[str, frozenset[str]] = {}
+        self._postings: dict[str, dict[str, None]] = {}
+        self._aliases: dict[str, str] = {}
+        self._seq: dict[str, int] = {}
+        self._next_seq = 0
+        self._lock = threading.RLock()
+        if facts:
+            self.update(facts)
+
+    def __getitem__(self, key: str) -> IngredientFact:
+        return self._facts[key]
+
+    def __setitem__(self, key: str, fact: IngredientFact) -> None:
+        with self._lock:
+            if key not in self._facts:
+                tokens = frozenset(_term_tokens(key))
+                self._tokens[key] = tokens
+                self._seq[key] = self._next_seq
+                self._next_seq += 1
+                for tok in tokens:
+                    self._postings.setdefault(tok, {})[key] = None
+                norm = _normalize_term(key)
+                if norm and norm != key:
+                    self._aliases.setdefault(norm, key)
+            self._facts[key] = fact
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            del self._facts[key]
+            self._seq.pop(key, None)
+            for tok in self._tokens.pop(key, ()):
+                keys = self._postings.get(tok)
+                if keys is not None:
+                    keys.pop(key, None)
+                    if not keys:
+                        del self._postings[tok]
+            self._aliases = {n: k for n, k in self._aliases.items() if k != key}
+
+    def __iter__(self):
+        return iter(self._facts)
+
+    def __len__(self) -> int:
+        return len(self._facts)
+
+    def best(self, term: str) -> IngredientFact | None:
+        """Exact key, then normalized alias, then the key sharing the most tokens (earliest wins ties)."""
+        with self._lock:
+            direct = self._facts.get(term)
+            if direct:
+                return direct
+            alias = self._aliases.get(term)
+            if alias is not None and self._facts.get(alias):
+                return self._facts[alias]
+
+            term_tokens = _term_tokens(term)
+            if not term_tokens:
+                return None
 
-    direct = fact_cache.get(term)
-    if direct:
-        return direct
+            direct_norm = self._facts.get(' '.join(sorted(term_tokens)))
+            if direct_norm:
+                return direct_norm
 
-    term_tokens = _term_tokens(term)
-    if not term_tokens:
-        return None
+            overlaps: dict[str, int] = {}
+            for tok in term_tokens:
+                for key in self._postings.get(tok, ()):
+                    overlaps[key] = overlaps.get(key, 0) + 1
+            if not overlaps:
+                return None
 
-    normalized = ' '.join(sorted(term_tokens))
-    direct_norm = fact_cache.get(normalized)
-    if direct_norm:
-        return direct_norm
+            # earliest-inserted key wins ties, matching a linear scan in insertion order
+            best_key = max(overlaps, key=lambda k: (overlaps[k], -self._seq[k]))
+            return self._facts[best_key] or None
 
-    best = None
-    best_overlap = 0
-    for key, fact in fact_cache.items():
-        key_tokens = _term_tokens(key)
-        if not key_tokens:
-            continue
-        overlap = len(term_tokens & key_tokens)
-        if overlap > best_overlap:
-            best = fact
-            best_overlap = overlap
-    return best if best_overlap else None
+
+def _best_cached_fact(term: str, fact_cache: Mapping[str, IngredientFact] | None) -> IngredientFact | None:
+    if not fact_cache:
+        return None
+    if not isinstance(fact_cache, FactIndex):
+        fact_cache = FactIndex({k: v for k, v in fact_cache.items() if v})
+    return fact_cache.best(term)
 
 
 def _parse_calorie_rules(form) -> tuple[list[dict], list[str]]:
@@ -546,12 +660,56 @@ def _enforce_calorie_rules(meals: list[dict], calorie_rules: list[dict]) -> tupl
     return kept, violations
 
 
-def _missing_calorie_terms(ingredients, fact_cache: dict[str, IngredientFact] | None) -> list[str]:
-    missing: list[str] = []
-    if not ingredients:
-        return missing
+def _ingredient_signature(ingredients) -> int:
+    parts = []
+    for ing in ingredients or []:
+        if isinstance(ing, dict):
+            parts.append((ing.get('name'), ing.get('raw'), ing.get('note'), ing.get('weight_g'), ing.get('weight_oz')))
+        else:
+            parts.append(str(ing))
+    return hash(repr(parts))
+
+
+class _MacroMemo:
+    """Per-meal macro bookkeeping kept beside the meal dicts, not in them.
+
+    Meal dicts are the response payload (SSE events, job results), so the
+    parsed inputs and "already totalled" signatures live here instead. Entries
+    hold the meal itself, which keeps id() stable while the entry exists.
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[int, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, meal: dict) -> dict:
+        with self._lock:
+            entry = self._entries.get(id(meal))
+            if entry is None or entry['meal'] is not meal:
+                entry = {'meal': meal, 'inputs': None, 'applied': None}
+                self._entries[id(meal)] = entry
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(id(meal))
+            return entry
+
 
-    for ingredient in ingredients:
+_MACRO_MEMO = _MacroMemo()
+
+
+def _macro_inputs(meal: dict) -> list[tuple[int, float, str, str]]:
+    """(index, grams, lookup term, name) per weighed ingredient, parsed once per ingredient list."""
+    ingredients = meal.get('ingredients') or []
+    signature = _ingredient_signature(ingredients)
+    memo = _MACRO_MEMO.get(meal)
+    cached = memo['inputs']
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    inputs: list[tuple[int, float, str, str]] = []
+    for idx, ingredient in enumerate(ingredients):
         quantity, unit, name = _extract_ingredient_parts(ingredient)
         if unit != 'g' or quantity is None:
             continue
@@ -559,7 +717,15 @@ def _missing_calorie_terms(ingredients, fact_cache: dict[str, IngredientFact] |
         term = _normalize_term(name)
         if not term or term in _CONDIMENT_TERMS:
             continue
+        inputs.append((idx, quantity, term, name))
 
+    memo['inputs'] = (signature, inputs)
+    return inputs
+
+
+def _missing_calorie_terms(meal: dict, fact_cache: Mapping[str, IngredientFact] | None) -> list[str]:
+    missing: list[str] = []
+    for _, _, term, name in _macro_inputs(meal):
         fact = _best_cached_fact(term, fact_cache or {})
         if not fact:
             missing.append(name or term)
@@ -567,33 +733,29 @@ def _missing_calorie_terms(ingredients, fact_cache: dict[str, IngredientFact] |
     return missing
 
 
-def apply_usda_macros(meals: list[dict], fact_cache: dict[str, IngredientFact] | None = None) -> None:
+def apply_usda_macros(meals: list[dict], fact_cache: Mapping[str, IngredientFact] | None = None) -> None:
     if not meals or INGREDIENT_RETRIEVER is None:
         return
 
     cache: dict[str, object | None] = {}
-    precomputed = {k: v for k, v in (fact_cache or {}).items() if v}
-    if precomputed:
-        for key, fact in list(precomputed.items()):
-            norm = _normalize_term(key)
-            if norm and norm not in precomputed:
-                precomputed[norm] = fact
+    if isinstance(fact_cache, FactIndex):
+        precomputed = fact_cache
+    else:
+        precomputed = FactIndex({k: v for k, v in (fact_cache or {}).items() if v})
 
     for meal in meals:
+        # already totalled for exactly these ingredients (e.g. by the stream path)
+        if meal.get('_usda_macro_source') and _MACRO_MEMO.get(meal)['applied'] == _ingredient_signature(meal.get('ingredients')):
+            continue
+
         totals = {'calories': 0.0, 'protein': 0.0, 'carbs': 0.0, 'fats': 0.0}
         matched = False
         contributions: list[dict[str, float | str]] = []
 
         ingredients_list = meal.get('ingredients') or []
-        for idx, ingredient in enumerate(ingredients_list):
-            quantity, unit, name = _extract_ingredient_parts(ingredient)
-            if unit != 'g' or quantity is None:
-                continue
-
-            term = _normalize_term(name)
-            if not term or term in _CONDIMENT_TERMS:
-                continue
-
+        inputs = _macro_inputs(meal)
+        for idx, quantity, term, name in inputs:
+            ingredient = ingredients_list[idx]
             fact = cache.get(term)
             if fact is None:
                 fact = _best_cached_fact(term, precomputed)
@@ -644,6 +806,10 @@ def apply_usda_macros(meals: list[dict], fact_cache: dict[str, IngredientFact] |
 
             if isinstance(ingredient, dict):
                 ingredient['calories'] = rounded_cal
+                # kept on the saved recipe_ingredients row
+                ingredient['grams'] = round(quantity, 1)
+                if fact.source_id.startswith('fdc:'):
+                    ingredient['fdc_id'] = _safe_int(fact.source_id[4:])
             else:
                 existing = ingredients_list[idx]
                 if isinstance(existing, str) and 'kcal' not in existing.lower():
@@ -659,6 +825,12 @@ def apply_usda_macros(meals: list[dict], fact_cache: dict[str, IngredientFact] |
         else:
             meal['_usda_macro_source'] = 'unverified'
 
+        # string ingredients gained a "[N kcal]" suffix; remember the post-pass shape
+        signature = _ingredient_signature(ingredients_list)
+        memo = _MACRO_MEMO.get(meal)
+        memo['applied'] = signature
+        memo['inputs'] = (signature, inputs)
+
 # Initialize DB with app
 db.init_app(app)
 
@@ -718,6 +890,19 @@ def _ensure_generated_recipes_calories_column() -> None:
         logging.exception('Failed to ensure generated_recipes.calories column')
 
 
+def _ensure_generated_recipes_page_index() -> None:
+    """Index the (user_id, created_on, meal_id) keyset used to page saved meals."""
+    try:
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS generated_recipes_user_page_idx "
+            "ON generated_recipes (user_id, created_on DESC, meal_id DESC)"
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logging.exception('Failed to ensure generated_recipes paging index')
+
+
 def _ensure_collections_primary_key() -> None:
     """Allow multiple collections per user by enforcing composite primary key."""
     try:
@@ -737,10 +922,23 @@ with app.app_context():
         db.create_all()  # Ensure required tables (collections, etc.) exist before requests
         _ensure_password_hash_column()
         _ensure_generated_recipes_calories_column()
+        _ensure_generated_recipes_page_index()
         _ensure_collections_primary_key()
     except Exception:
         logging.exception('Database initialization failed')
 
+@app.cli.command("backfill-ingredients")
+@click.option("--batch-size", default=500, show_default=True, help="recipes read per query")
+def backfill_ingredients_command(batch_size):
+    """Fill recipe_ingredients for recipes saved before the table existed.
+
+    Run once after deploying, e.g. `flask --app main backfill-ingredients`;
+    it is not run at startup so workers do not rescan or race on the table.
+    """
+    filled = backfillRecipeIngredients(batch_size=batch_size)
+    click.echo(f"Backfilled recipe_ingredients for {filled} saved recipes")
+
+
 # Routes
 @app.route("/")
 def index():
@@ -796,164 +994,264 @@ def get_started():
 @app.route("/shopping_list")
 def shopping_list():
     uid = session.get('user_id')
-    mealObjs: list[Meal] = []
-    colObjs: dict[str, MealCollection] = {}
+    cursor = request.args.get('cursor')
+    mealObjs, cols, next_cursor = loadSavedMeals(uid, cursor)
 
     if uid:
-        saved_meals = getAllMeals(uid) or []
-        collection_links = getCollectionMeals(uid) or []
-
-        meal_lookup: dict[str, Meal] = {}
-        for record in saved_meals:
-            ingredients = _deserialize_list(record.ingredients)
-            instructions = _deserialize_list(record.instructions)
-            currMeal = Meal(
-                record.meal_type,
-                record.recipe_name,
-                ingredients,
-                record.calories or 0,
-                instructions,
-                record.carbs or 0,
-                record.fats or 0,
-                record.protein or 0,
-            )
-            setattr(currMeal, 'id', record.meal_id)
-            mealObjs.append(currMeal)
-            meal_lookup[record.meal_id] = currMeal
-
-        for link in collection_links:
-            collection = colObjs.setdefault(link.collection_name, MealCollection([], link.collection_name))
-            meal_obj = meal_lookup.get(link.meal_id)
-            if meal_obj and meal_obj not in collection.meals:
-                collection.meals.append(meal_obj)
-
-        session['shopping_meal_ids'] = [str(getattr(meal, 'id')) for meal in mealObjs if getattr(meal, 'id', None)]
+        # "load more" pages add to the meals the list may be built from
+        shown = list(session.get('shopping_meal_ids') or []) if cursor else []
+        shown.extend(str(getattr(meal, 'id')) for meal in mealObjs if getattr(meal, 'id', None))
+        session['shopping_meal_ids'] = shown
     else:
         session.pop('shopping_meal_ids', None)
 
-    return render_template("shopping_list.html", meals=mealObjs, cols=list(colObjs.values()))
+    return render_template("shopping_list.html", meals=mealObjs, cols=cols, next_cursor=next_cursor)
 
 @app.route("/calendar")
 def calendar():
+    meals, collections, next_cursor = loadSavedMeals(session.get('user_id'), request.args.get('cursor'))
+    return render_template("calendar.html", meals=meals, collections=collections, next_cursor=next_cursor)
+
+@app.route("/user_meals", methods=["GET"], endpoint="user_meals")
+def user_meals():
     uid = session.get('user_id')
-    meals: list[Meal] = []
-    collections: list[MealCollection] = []
+    meals, collections, next_cursor = loadSavedMeals(uid, request.args.get('cursor'))
+    # totals per collection, since a page only holds some of each collection's meals
+    collection_counts = {row['name']: row['item_count'] for row in getUserMeals(uid)}
+    return render_template(
+        "user_meals.html",
+        meals=meals,
+        collections=collections,
+        collection_counts=collection_counts,
+        next_cursor=next_cursor,
+    )
 
-    if uid:
-        saved_meals = getAllMeals(uid) or []
-        collection_links = getCollectionMeals(uid) or []
-
-        meal_lookup: dict[str, Meal] = {}
-        for record in saved_meals:
-            ingredients = _deserialize_list(record.ingredients)
-            instructions = _deserialize_list(record.instructions)
-            curr_meal = Meal(
-                record.meal_type,
-                record.recipe_name,
-                ingredients,
-                record.calories or 0,
-                instructions,
-                record.carbs or 0,
-                record.fats or 0,
-                record.protein or 0,
-            )
-            setattr(curr_meal, 'id', record.meal_id)
-            meals.append(curr_meal)
-            meal_lookup[record.meal_id] = curr_meal
 
-        collection_map: dict[str, MealCollection] = {}
-        for link in collection_links:
-            collection = collection_map.setdefault(link.collection_name, MealCollection([], link.collection_name))
-            meal_obj = meal_lookup.get(link.meal_id)
-            if meal_obj and meal_obj not in collection.meals:
-                collection.meals.append(meal_obj)
-        collections = list(collection_map.values())
 
-    return render_template("calendar.html", meals=meals, collections=collections)
+# ---------------- meal-plan generation pipeline ----------------
+# Shared by the classic /startMealPlan form post and the streaming endpoint.
 
-@app.route("/user_meals", methods=["GET"], endpoint="user_meals")
-def user_meals():
-    uid = session.get('user_id')
-    meals: list[Meal] = []
-    collections: list[MealCollection] = []
-
-    def _as_list(value):
-        if value in (None, ''):
-            return []
-        if isinstance(value, list):
-            return value
-        if isinstance(value, str):
-            try:
-                parsed = json.loads(value)
-                if isinstance(parsed, list):
-                    return parsed
-                return [parsed]
-            except Exception:
-                return [value]
-        return [value]
+_PLANT_MILK_ALLOW = (
+    'almond milk', 'soy milk', 'oat milk', 'coconut milk',
+    'cashew milk', 'hemp milk', 'pea milk', 'rice milk'
+)
 
-    if uid:
-        saved_meals = getAllMeals(uid) or []
-        collection_links = getCollectionMeals(uid) or []
-
-        meal_lookup: dict[str, Meal] = {}
-        for record in saved_meals:
-            ingredients = _as_list(record.ingredients)
-            instructions = _as_list(record.instructions)
-            curr_meal = Meal(
-                record.meal_type,
-                record.recipe_name,
-                ingredients,
-                record.calories or 0,
-                instructions,
-                record.carbs or 0,
-                record.fats or 0,
-                record.protein or 0,
-            )
-            setattr(curr_meal, 'id', record.meal_id)
-            meals.append(curr_meal)
-            meal_lookup[record.meal_id] = curr_meal
 
-        collection_map: dict[str, MealCollection] = {}
-        for link in collection_links:
-            collection = collection_map.setdefault(link.collection_name, MealCollection([], link.collection_name))
-            meal_obj = meal_lookup.get(link.meal_id)
-            if meal_obj and meal_obj not in collection.meals:
-                collection.meals.append(meal_obj)
-        collections = list(collection_map.values())
+@dataclass
+class _GenerationContext:
+    """Everything one meal-plan request needs after the form has been parsed."""
+
+    user_id: Any
+    merged_prefs: dict
+    desired_counts: dict[str, int]
+    total_needed: int
+    calorie_rules: list[dict]
+    calorie_rule_summaries: list[str]
+    banned_terms: list[str]
+    retrieval_batch: RetrievalBatch | None
+    variety_context: str | None
+    user_prompt_text: str
+    prompt: str
+    tool_cache: dict[str, dict] = field(default_factory=dict)
+    tool_fact_cache: FactIndex = field(default_factory=FactIndex)
+
+    def remember_fact(self, term: str, fact: IngredientFact, warnings: list[str] | None = None) -> dict:
+        """Record a fact so later lookups (tool calls or macro totals) reuse it; returns the tool result."""
+        cache_key = term.strip().lower()
+        fact_payload = _tool_fact_payload(fact)
+        if warnings:
+            fact_payload["warnings"] = warnings
+        result = {"ok": True, "ingredient": term, "fact": fact_payload}
+        self.tool_fact_cache[cache_key] = fact
+        normalized_term = _normalize_term(term)
+        if normalized_term:
+            self.tool_fact_cache.setdefault(normalized_term, fact)
+        self.tool_cache[cache_key] = result
+        return result
 
-    return render_template("user_meals.html", meals=meals, collections=collections)
+    def lookup_tool(self, function_name: str, args: dict) -> dict:
+        if function_name != 'lookupIngredient':
+            return {"ok": False, "error": f"unsupported_tool:{function_name}"}
 
+        term = str(args.get('ingredient') or '').strip()
+        if not term:
+            return {"ok": False, "error": "ingredient_required"}
 
+        cache_key = term.lower()
+        if cache_key in self.tool_cache:
+            return self.tool_cache[cache_key]
+
+        try:
+            batch = INGREDIENT_RETRIEVER.fetch([term])
+        except Exception as exc:
+            logging.exception("lookupIngredient failed for %s", term)
+            result = {"ok": False, "ingredient": term, "error": "lookup_failed"}
+        else:
+            fact = batch.facts[0] if batch and batch.facts else None
+            if not fact:
+                result = {"ok": False, "ingredient": term, "error": "not_found"}
+                if batch and batch.warnings:
+                    result["warnings"] = batch.warnings
+            else:
+                return self.remember_fact(term, fact, batch.warnings if batch else None)
+
+        self.tool_cache[cache_key] = result
+        return result
+
+
+def _tool_fact_payload(fact: IngredientFact) -> dict:
+    return {
+        "canonical_name": fact.canonical_name,
+        "source_id": fact.source_id,
+        "summary": fact.summary,
+        "serving_size_g": fact.nutrition.serving_size_g,
+        "serving_size_oz": round(fact.nutrition.serving_size_g / _GRAMS_PER_OUNCE, 4),
+        "calories": fact.nutrition.calories,
+        "protein_g": fact.nutrition.protein_g,
+        "carbs_g": fact.nutrition.carbs_g,
+        "fats_g": fact.nutrition.fats_g,
+        "tags": fact.tags,
+    }
+
+
+def _prefetch_candidates(user_id, selected_diets: list[str], banned_terms: list[str], skip_terms: list[str]) -> list[str]:
+    """Ingredients the model is likely to look up: past saved ingredients, then diet staples."""
+    candidates: list[str] = []
+    if user_id:
+        try:
+            candidates.extend(getFrequentIngredients(int(user_id), limit=_PREFETCH_LIMIT))
+        except Exception:
+            logging.exception("Failed to load past ingredients for prefetch")
+    for diet in selected_diets or ['none']:
+        candidates.extend(_DIET_STAPLES.get(diet, _DEFAULT_STAPLES))
+
+    seen = {_normalize_term(term) for term in skip_terms}
+    terms: list[str] = []
+    for term in candidates:
+        normalized = _normalize_term(term)
+        if not normalized or normalized in seen or normalized in _CONDIMENT_TERMS:
+            continue
+        seen.add(normalized)
+        if _find_banned_hit([term], banned_terms)[0]:
+            continue
+        terms.append(normalized)
+        if len(terms) >= _PREFETCH_LIMIT:
+            break
+    return terms
+
+
+_prefetch_pool = None
+_prefetch_pid = None
+_prefetch_pending = None
+_prefetch_lock = threading.Lock()
+
+
+def _warm_facts(terms: list[str]) -> None:
+    try:
+        found = INGREDIENT_RETRIEVER.warm(terms)
+    except Exception:
+        logging.exception("Ingredient prefetch failed for %s", terms)
+        return
+    logging.debug("Prefetched facts for %d/%d likely ingredients", found, len(terms))
+
+
+def _prefetch_facts(terms: list[str]) -> list[tuple[str, IngredientFact]]:
+    """Return cached facts for terms and warm the cache for the rest in the background.
+
+    The cached facts seed the request's lookupIngredient cache, so those tool calls
+    answer without a retriever round trip. Misses go to a single prefetch thread,
+    separate from the retriever's fetch pool, and nothing waits on it. A warm still
+    running from an earlier request is not queued behind, so a slow USDA API cannot
+    pile up work.
+    """
+    global _prefetch_pool, _prefetch_pid, _prefetch_pending
+    if not terms:
+        return []
+    try:
+        batch = INGREDIENT_RETRIEVER.cached(terms)
+    except Exception:
+        logging.exception("Ingredient prefetch cache read failed for %s", terms)
+        return []
+    hits = [(term, fact) for term, fact in zip(batch.query_terms, batch.facts) if fact]
+    misses = [term for term, fact in zip(batch.query_terms, batch.facts) if not fact]
+    if not misses:
+        return hits
+    with _prefetch_lock:
+        # gunicorn forks after import; each worker process gets its own thread
+        if _prefetch_pool is None or _prefetch_pid != os.getpid():
+            _prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fact-prefetch")
+            _prefetch_pid = os.getpid()
+            _prefetch_pending = None
+        if _prefetch_pending is not None and not _prefetch_pending.done():
+            logging.debug("Skipping prefetch of %s; previous warm still running", misses)
+        else:
+            _prefetch_pending = _prefetch_pool.submit(_warm_facts, misses)
+    return hits
+
+
+def _normalize_meal_type(tag: str | None) -> str:
+    t = (tag or '').strip().lower()
+    if t.startswith('breakfast'):
+        return 'breakfast'
+    if t.startswith('lunch'):
+        return 'lunch'
+    if t.startswith('dinner'):
+        return 'dinner'
+    return ''
+
+
+@lru_cache(maxsize=64)
+def _banned_matcher(banned_terms: tuple[str, ...]) -> re.Pattern | None:
+    """One alternation per constraint set; matches wherever any banned term appears."""
+    terms = [term for term in banned_terms if term]
+    if not terms:
+        return None
+    return re.compile('|'.join(re.escape(term) for term in terms))
+
+
+def _find_banned_hit(ingredients, banned_terms: list[str]):
+    """Return (banned_term, ingredient_text) if any normalized ingredient violates banned constraints."""
+    if not banned_terms:
+        return (None, None)
+
+    matcher = _banned_matcher(tuple(banned_terms))
+    if matcher is None:
+        return (None, None)
+
+    for ing in ingredients or []:
+        if isinstance(ing, dict):
+            text = " ".join(filter(None, [ing.get("name"), ing.get("raw"), ing.get("note")]))
+        else:
+            text = str(ing)
+        haystack = text.lower()
+        # most ingredients hit nothing; one regex pass rules them out before the per-term check
+        if not matcher.search(haystack):
+            continue
+        for banned in banned_terms:
+            if banned and banned in haystack:
+                if banned == 'milk' and any(alt in haystack for alt in _PLANT_MILK_ALLOW):
+                    # Allow plant-based milks even when "milk" is banned for vegan diets
+                    continue
+                return banned, text.strip() or text
+    return (None, None)
 
-# main function 
-# use for testing
-# adjust user prefrences here
-# if you add new preferences in the above classes
-# be sure to add them here too
-@app.route("/startMealPlan", methods = ['GET', 'POST'])
-def startMealPlan():
-    # Tess TO DO:
-    # modify to be able to read global user preferences
-    # merge final constraints
-    # pass merged constraints into promptGen.generate_prompt(final_constraints)
-    if request.method == 'GET':
-        return render_template("mealGen.html")
 
+def _build_generation_context(form, user_id) -> _GenerationContext:
+    """Parse the meal-plan form (request.form or request.args) into a prompt and rules."""
     # Gather list-style preferences before flattening
-    favorite_terms_input = [f.strip() for f in request.form.getlist("favorites[]") if f.strip()]
+    favorite_terms_input = [f.strip() for f in form.getlist("favorites[]") if f.strip()]
     manual_variety_terms = _dedupe_terms(favorite_terms_input)
 
     # Log the received form data
-    form_prefs = request.form.to_dict(flat=True)
+    form_prefs = form.to_dict(flat=True)
     activity_level = _normalize_activity_level(form_prefs.get('activity'))
-    selected_diets = [d.strip().lower() for d in request.form.getlist("dietary") if d.strip()]
+    selected_diets = [d.strip().lower() for d in form.getlist("dietary") if d.strip()]
     if selected_diets:
         # store the first one for compatibility; remainder are handled when we build banned lists
         form_prefs["dietary_restrictions"] = selected_diets[0]
     logging.debug(f"Received form data: {form_prefs}")
 
-    calorie_rules, calorie_rule_summaries = _parse_calorie_rules(request.form)
+    calorie_rules, calorie_rule_summaries = _parse_calorie_rules(form)
     if calorie_rules and not form_prefs.get('calories'):
         fallback = next((rule for rule in calorie_rules if rule.get('scope_type') == 'per_meal' and not rule.get('meal_type')), None)
         if fallback:
@@ -962,7 +1260,6 @@ def startMealPlan():
     # Load stored global constraints and user-specific constraints (if logged in)
     global_constraints = cs.get() or {}
     user_constraints = {}
-    user_id = session.get('user_id')
     numeric_user_id = None
     if user_id:
         try:
@@ -972,7 +1269,7 @@ def startMealPlan():
             logging.exception("Failed to load user constraints")
             numeric_user_id = None
 
-    user_obj = _user_from_form(request.form)
+    user_obj = _user_from_form(form)
     user_prompt_text = ""
 
     # Merge constraints (pure function; does not persist)
@@ -1031,29 +1328,7 @@ def startMealPlan():
                     banned_terms.append(low)
                     existing.add(low)
 
-    def _find_banned_hit(ingredients):
-        """Return (banned_term, ingredient_text) if any normalized ingredient violates banned constraints."""
-        if not banned_terms:
-            return (None, None)
-
-        plant_milk_allow = (
-            'almond milk', 'soy milk', 'oat milk', 'coconut milk',
-            'cashew milk', 'hemp milk', 'pea milk', 'rice milk'
-        )
-
-        for ing in ingredients or []:
-            if isinstance(ing, dict):
-                text = " ".join(filter(None, [ing.get("name"), ing.get("raw"), ing.get("note")]))
-            else:
-                text = str(ing)
-            haystack = text.lower()
-            for banned in banned_terms:
-                if banned and banned in haystack:
-                    if banned == 'milk' and any(alt in haystack for alt in plant_milk_allow):
-                        # Allow plant-based milks even when "milk" is banned for vegan diets
-                        continue
-                    return banned, text.strip() or text
-        return (None, None)
+    warmed: list[tuple[str, IngredientFact]] = []
 
     def _fetch_variety_facts(terms: list[str]) -> RetrievalBatch | None:  # type: ignore[name-defined]
         if not terms:
@@ -1065,6 +1340,7 @@ def startMealPlan():
             logging.exception("Ingredient retrieval failed for %s", fetch_terms)
             return None
         if batch and batch.facts:
+            warmed.extend((term, fact) for term, fact in zip(batch.query_terms, batch.facts) if fact)
             batch.facts = [fact for fact in batch.facts if fact]
         if batch and batch.facts:
             logging.debug("Retrieved ingredient facts for variety focus: %s", fetch_terms)
@@ -1079,6 +1355,14 @@ def startMealPlan():
         manual_terms_consumed = False
         retrieval_batch = _fetch_variety_facts(favorite_terms)
 
+    if _PREFETCH_ENABLED and getattr(INGREDIENT_RETRIEVER, "cache", None) is not None:
+        # cached facts answer the model's lookupIngredient calls directly and misses are
+        # warmed in the background; they stay out of the prompt so they cannot steer what gets cooked.
+        # Without a cache (stub, local store, USDA_CACHE=off) a warm would be thrown away.
+        warmed.extend(_prefetch_facts(_prefetch_candidates(
+            user_id, selected_diets, banned_terms, skip_terms=[term for term, _ in warmed] + favorite_terms,
+        )))
+
     if favorite_terms:
         anchor_text = ', '.join(favorite_terms)
         if manual_terms_consumed:
@@ -1103,205 +1387,388 @@ def startMealPlan():
             f"{variety_context}. Make breakfast, lunch, and dinner feel distinct with different primary proteins or cuisines; avoid repeating the same entree twice."
         )
 
-    tool_cache: dict[str, dict] = {}
-    tool_fact_cache: dict[str, IngredientFact] = {}
-
-    def _lookup_ingredient_tool(function_name: str, args: dict) -> dict:
-        if function_name != 'lookupIngredient':
-            return {"ok": False, "error": f"unsupported_tool:{function_name}"}
-
-        term = str(args.get('ingredient') or '').strip()
-        if not term:
-            return {"ok": False, "error": "ingredient_required"}
-
-        cache_key = term.lower()
-        if cache_key in tool_cache:
-            return tool_cache[cache_key]
-
-        try:
-            batch = INGREDIENT_RETRIEVER.fetch([term])
-        except Exception as exc:
-            logging.exception("lookupIngredient failed for %s", term)
-            result = {"ok": False, "ingredient": term, "error": "lookup_failed"}
-        else:
-            fact = batch.facts[0] if batch and batch.facts else None
-            if not fact:
-                result = {"ok": False, "ingredient": term, "error": "not_found"}
-                if batch and batch.warnings:
-                    result["warnings"] = batch.warnings
-            else:
-                fact_payload = {
-                    "canonical_name": fact.canonical_name,
-                    "source_id": fact.source_id,
-                    "summary": fact.summary,
-                    "serving_size_g": fact.nutrition.serving_size_g,
-                    "serving_size_oz": round(fact.nutrition.serving_size_g / _GRAMS_PER_OUNCE, 4),
-                    "calories": fact.nutrition.calories,
-                    "protein_g": fact.nutrition.protein_g,
-                    "carbs_g": fact.nutrition.carbs_g,
-                    "fats_g": fact.nutrition.fats_g,
-                    "tags": fact.tags,
-                }
-                if batch and batch.warnings:
-                    fact_payload["warnings"] = batch.warnings
-                result = {"ok": True, "ingredient": term, "fact": fact_payload}
-                tool_fact_cache[cache_key] = fact
-                normalized_term = _normalize_term(term)
-                if normalized_term:
-                    tool_fact_cache.setdefault(normalized_term, fact)
-
-        tool_cache[cache_key] = result
-        return result
-
     # Generate the prompt and log it
-    base_prompt = generate_prompt(
+    prompt_sections = generate_prompt_sections(
         merged_prefs,
         retrieval_batch=retrieval_batch,
         calorie_rules=calorie_rule_summaries,
         variety_context=variety_context,
     )
-    prompt = f"{user_prompt_text}\n\n{base_prompt}".strip() if user_prompt_text else base_prompt
+    base_prompt = join_prompt_sections(prompt_sections)
+    # profile text goes last so every request shares the static prompt prefix
+    prompt = f"{base_prompt}\n\n{user_prompt_text}".strip() if user_prompt_text else base_prompt
+    section_tokens = section_token_counts(prompt_sections)
+    if user_prompt_text:
+        section_tokens['user_profile'] = approx_tokens(user_prompt_text)
+    logging.debug("Prompt section tokens (approx): %s", section_tokens)
     logging.debug(f"Generated prompt: {prompt}")
 
-    def _normalize_meal_type(tag: str | None) -> str:
-        t = (tag or '').strip().lower()
-        if t.startswith('breakfast'):
-            return 'breakfast'
-        if t.startswith('lunch'):
-            return 'lunch'
-        if t.startswith('dinner'):
-            return 'dinner'
-        return ''
-
-    MAX_MODEL_ATTEMPTS = 2
-    attempt = 0
-    meals: list[dict] = []
-    data: dict = {"meals": []}
+    ctx = _GenerationContext(
+        user_id=user_id,
+        merged_prefs=merged_prefs,
+        desired_counts=desired_counts,
+        total_needed=total_needed,
+        calorie_rules=calorie_rules,
+        calorie_rule_summaries=calorie_rule_summaries,
+        banned_terms=banned_terms,
+        retrieval_batch=retrieval_batch,
+        variety_context=variety_context,
+        user_prompt_text=user_prompt_text,
+        prompt=prompt,
+    )
+    for term, fact in warmed:
+        ctx.remember_fact(term, fact)
+    return ctx
 
-    last_calorie_rule_violations: list[dict] = []
 
-    while True:
-        raw_data = call_model(prompt, tool_executor=_lookup_ingredient_tool)
+def _prompt_for_counts(ctx: _GenerationContext, counts: Mapping[str, int], avoid_names: list[str] | None = None) -> str:
+    """Same prompt as ctx.prompt but asking only for the given breakfast/lunch/dinner counts."""
+    prefs = dict(ctx.merged_prefs)
+    prefs['num_breakfast'] = counts.get('breakfast', 0)
+    prefs['num_lunch'] = counts.get('lunch', 0)
+    prefs['num_dinner'] = counts.get('dinner', 0)
+    base_prompt = generate_prompt(
+        prefs,
+        retrieval_batch=ctx.retrieval_batch,
+        calorie_rules=ctx.calorie_rule_summaries,
+        variety_context=ctx.variety_context,
+        avoid_recipes=avoid_names,
+    )
+    return f"{base_prompt}\n\n{ctx.user_prompt_text}".strip() if ctx.user_prompt_text else base_prompt
+
+
+def _fanout_batches(counts: Mapping[str, int]) -> list[dict[str, int]]:
+    """Split requested counts into one request per daypart (and per chunk of N meals)."""
+    batches: list[dict[str, int]] = []
+    for meal_type in ('breakfast', 'lunch', 'dinner'):
+        remaining = counts.get(meal_type, 0)
+        chunk = _FANOUT_CHUNK if _FANOUT_CHUNK > 0 else remaining
+        while remaining > 0:
+            size = min(chunk, remaining)
+            batches.append({'breakfast': 0, 'lunch': 0, 'dinner': 0, meal_type: size})
+            remaining -= size
+    return batches
+
+
+def _single_call_prompt(ctx: _GenerationContext, counts: Mapping[str, int], avoid_names: list[str] | None) -> str:
+    if dict(counts) == ctx.desired_counts and not avoid_names:
+        return ctx.prompt
+    return _prompt_for_counts(ctx, counts, avoid_names)
+
+
+def _unpack_model_meals(raw_data) -> tuple[list, bool]:
+    if not isinstance(raw_data, dict):
+        logging.warning('Model returned invalid payload: %r', raw_data)
+        raw_data = {}
+    partial_response = bool(raw_data.pop('_partial', False))
+    logging.debug("Model response: %s", raw_data)
+    return raw_data.get("meals", []) or [], partial_response
+
+
+def _merge_fanout(batches: list[dict[str, int]], results: list, avoid_names: list[str] | None) -> tuple[list, bool]:
+    meals: list = []
+    seen_names: set[str] = {name.strip().lower() for name in avoid_names or []}
+    partial_response = False
+    for batch, raw_data in zip(batches, results):
         if not isinstance(raw_data, dict):
-            logging.warning('Model returned invalid payload (attempt %s): %r', attempt + 1, raw_data)
-            raw_data = {}
+            logging.warning('Model returned invalid payload for batch %s: %r', batch, raw_data)
+            continue
+        partial_response = partial_response or bool(raw_data.pop('_partial', False))
+        batch_type = next(k for k, v in batch.items() if v)
+        for meal in raw_data.get("meals", []) or []:
+            if isinstance(meal, dict):
+                # each batch asked for a single daypart, so an untagged meal belongs to it
+                if not _normalize_meal_type(meal.get('mealType')):
+                    meal['mealType'] = batch_type
+                name_key = (meal.get('name') or '').strip().lower()
+                if name_key and name_key in seen_names:
+                    logging.debug('Dropping duplicate recipe from fan-out: %s', meal.get('name'))
+                    continue
+                if name_key:
+                    seen_names.add(name_key)
+            meals.append(meal)
+    return meals, partial_response
 
-        partial_response = bool(raw_data.pop('_partial', False))
-        logging.debug("Model response (attempt %s): %s", attempt + 1, raw_data)
 
-        data = raw_data or {"meals": []}
-        meals = data.get("meals", []) or []
+def _request_meals(
+    ctx: _GenerationContext,
+    counts: Mapping[str, int],
+    avoid_names: list[str] | None = None,
+) -> tuple[list, bool]:
+    """Ask the model for `counts` meals; returns (raw meals, partial_response)."""
+    batches = _fanout_batches(counts) if _FANOUT_MODE == 'daypart' else []
+    if len(batches) <= 1:
+        return _unpack_model_meals(call_model(_single_call_prompt(ctx, counts, avoid_names), tool_executor=ctx.lookup_tool))
 
+    def _run_batch(batch: dict[str, int]) -> dict:
         try:
-            normalize_meals(meals)
+            return call_model(_prompt_for_counts(ctx, batch, avoid_names), tool_executor=ctx.lookup_tool)
         except Exception:
-            logging.exception('normalize_meals failed')
+            logging.exception('Model call failed for batch %s', batch)
+            return {}
 
-        cleaned: list[dict] = []
-        dropped_for_weight = 0
-        dropped_for_calorie = 0
-        for m in meals:
-            if not isinstance(m, dict):
-                logging.warning('Skipping non-dict meal: %r', m)
-                continue
+    logging.debug("Fanning out %d model calls: %s", len(batches), batches)
+    with ThreadPoolExecutor(max_workers=min(_FANOUT_WORKERS, len(batches)), thread_name_prefix="meal-fanout") as pool:
+        results = list(pool.map(_run_batch, batches))
+    return _merge_fanout(batches, results, avoid_names)
 
-            name = (m.get('name') or '').strip() or '(Untitled)'
-            m['name'] = name
-            m['mealType'] = (m.get('mealType') or '').strip()
 
-            for k in ('calories', 'carbs', 'fats', 'protein'):
-                v = m.get(k)
-                try:
-                    if v in (None, ''):
-                        m[k] = 0
-                    elif isinstance(v, str):
-                        num = re.sub(r'[^0-9\.\-]', '', v)
-                        m[k] = int(float(num)) if num else 0
-                    else:
-                        m[k] = int(float(v))
-                except Exception:
-                    m[k] = 0
+async def _request_meals_async(
+    ctx: _GenerationContext,
+    counts: Mapping[str, int],
+    avoid_names: list[str] | None = None,
+) -> tuple[list, bool]:
+    """_request_meals on call_model_async; lookupIngredient calls run in worker threads."""
+    batches = _fanout_batches(counts) if _FANOUT_MODE == 'daypart' else []
+    if len(batches) <= 1:
+        prompt = _single_call_prompt(ctx, counts, avoid_names)
+        return _unpack_model_meals(await call_model_async(prompt, tool_executor=ctx.lookup_tool))
 
-            new_ings = []
-            for ig in (m.get('ingredients') or []):
-                if isinstance(ig, dict):
-                    if (ig.get('name') or '').strip() or ig.get('quantity') is not None:
-                        new_ings.append(ig)
-                elif isinstance(ig, str):
-                    if ig.strip() and ig.strip() != '-':
-                        new_ings.append(ig.strip())
-            m['ingredients'] = new_ings
+    limit = asyncio.Semaphore(_FANOUT_WORKERS)
 
-            # Allow missing weights — USDA will fill in later
-            missing_weight = next((ig for ig in new_ings if not _has_explicit_weight(ig)), None)
+    async def _run_batch(batch: dict[str, int]) -> dict:
+        try:
+            async with limit:
+                return await call_model_async(_prompt_for_counts(ctx, batch, avoid_names), tool_executor=ctx.lookup_tool)
+        except Exception:
+            logging.exception('Model call failed for batch %s', batch)
+            return {}
 
+    logging.debug("Fanning out %d model calls: %s", len(batches), batches)
+    results = await asyncio.gather(*(_run_batch(batch) for batch in batches))
+    return _merge_fanout(batches, list(results), avoid_names)
 
-            banned_term, offending = _find_banned_hit(new_ings)
-            if banned_term:
-                logging.warning('Dropping %s because it contains banned ingredient "%s" (matched term "%s")', name, offending, banned_term)
-                continue
 
-            missing_calorie_terms = _missing_calorie_terms(new_ings, tool_fact_cache)
-            if missing_calorie_terms:
-                logging.warning(
-                    '%s missing cached nutrition facts for: %s. Will fetch from USDA backend.',
-                    name,
-                    ", ".join(missing_calorie_terms)
-                )
-                m.setdefault('_missing_tool_facts', missing_calorie_terms)
-
-            instr = m.get('instructions')
-            if instr is None:
-                m['instructions'] = []
-            elif isinstance(instr, str):
-                lines = [ln.strip() for ln in instr.splitlines() if ln.strip()]
-                if len(lines) == 1:
-                    numbered = [part.strip() for part in re.split(r'\s*(?:\d+\.)\s*', lines[0]) if part.strip()]
-                    if numbered:
-                        lines = numbered
-                    else:
-                        sentences = [part.strip() for part in re.split(r'(?<=\.)\s+(?=[A-Z])', lines[0]) if part.strip()]
-                        if sentences:
-                            lines = sentences
-                m['instructions'] = lines
-            elif isinstance(instr, list):
-                m['instructions'] = [str(x).strip() for x in instr if str(x).strip()]
-
-            if not m['ingredients']:
-                logging.warning('Dropping meal with no ingredients: %s', m.get('name'))
-                continue
+def _clean_generated_meal(m, ctx: _GenerationContext) -> dict | None:
+    """Coerce one model meal into the shape the templates expect; None if it must be dropped."""
+    if not isinstance(m, dict):
+        logging.warning('Skipping non-dict meal: %r', m)
+        return None
+
+    name = (m.get('name') or '').strip() or '(Untitled)'
+    m['name'] = name
+    m['mealType'] = (m.get('mealType') or '').strip()
+
+    for k in ('calories', 'carbs', 'fats', 'protein'):
+        v = m.get(k)
+        try:
+            if v in (None, ''):
+                m[k] = 0
+            elif isinstance(v, str):
+                num = re.sub(r'[^0-9\.\-]', '', v)
+                m[k] = int(float(num)) if num else 0
+            else:
+                m[k] = int(float(v))
+        except Exception:
+            m[k] = 0
+        # keep what the model said before USDA totals overwrite it
+        m[f'_model_{k}'] = m[k]
+
+    new_ings = []
+    for ig in (m.get('ingredients') or []):
+        if isinstance(ig, dict):
+            if (ig.get('name') or '').strip() or ig.get('quantity') is not None:
+                new_ings.append(ig)
+        elif isinstance(ig, str):
+            if ig.strip() and ig.strip() != '-':
+                new_ings.append(ig.strip())
+    m['ingredients'] = new_ings
+
+    banned_term, offending = _find_banned_hit(new_ings, ctx.banned_terms)
+    if banned_term:
+        logging.warning('Dropping %s because it contains banned ingredient "%s" (matched term "%s")', name, offending, banned_term)
+        return None
 
-            cleaned.append(m)
+    missing_calorie_terms = _missing_calorie_terms(m, ctx.tool_fact_cache)
+    if missing_calorie_terms:
+        logging.warning(
+            '%s missing cached nutrition facts for: %s. Will fetch from USDA backend.',
+            name,
+            ", ".join(missing_calorie_terms)
+        )
+        m.setdefault('_missing_tool_facts', missing_calorie_terms)
+
+    instr = m.get('instructions')
+    if instr is None:
+        m['instructions'] = []
+    elif isinstance(instr, str):
+        lines = [ln.strip() for ln in instr.splitlines() if ln.strip()]
+        if len(lines) == 1:
+            numbered = [part.strip() for part in re.split(r'\s*(?:\d+\.)\s*', lines[0]) if part.strip()]
+            if numbered:
+                lines = numbered
+            else:
+                sentences = [part.strip() for part in re.split(r'(?<=\.)\s+(?=[A-Z])', lines[0]) if part.strip()]
+                if sentences:
+                    lines = sentences
+        m['instructions'] = lines
+    elif isinstance(instr, list):
+        m['instructions'] = [str(x).strip() for x in instr if str(x).strip()]
+
+    if not m['ingredients']:
+        logging.warning('Dropping meal with no ingredients: %s', m.get('name'))
+        return None
 
-        meals = cleaned
+    return m
 
-        if total_needed and meals:
-            counts = {k: 0 for k in desired_counts}
-            limited: list[dict] = []
-            for meal in meals:
-                if len(limited) >= total_needed:
-                    break
-                mtype = _normalize_meal_type(meal.get('mealType'))
-                if mtype and counts[mtype] >= desired_counts[mtype]:
-                    continue
-                if mtype:
-                    counts[mtype] += 1
-                limited.append(meal)
-            meals = limited
 
-        data['meals'] = meals
+def _limit_to_counts(meals: list[dict], counts: Mapping[str, int]) -> list[dict]:
+    total_needed = sum(counts.values())
+    if not total_needed or not meals:
+        return meals
+    taken = {k: 0 for k in counts}
+    limited: list[dict] = []
+    for meal in meals:
+        if len(limited) >= total_needed:
+            break
+        mtype = _normalize_meal_type(meal.get('mealType'))
+        if mtype and taken[mtype] >= counts[mtype]:
+            continue
+        if mtype:
+            taken[mtype] += 1
+        limited.append(meal)
+    return limited
+
+
+def _fill_from_calorie_violations(meals: list[dict], violations: list[dict], total_needed: int) -> list[dict]:
+    if not (total_needed and len(meals) < total_needed and violations):
+        return meals
+    deficit = total_needed - len(meals)
+    logging.warning('Filling %d slots with closest calorie matches despite rule violations', deficit)
+    sorted_rejects = sorted(
+        violations,
+        key=lambda v: abs((v.get('calories') or 0) - (v.get('rule', {}).get('value') or 0))
+    )
+    # violations pile up across retries, so the same recipe can be rejected twice
+    # or come back later and pass; never fill with a name that is already in the plan
+    taken = {(m.get('name') or '').strip().lower() for m in meals}
+    for violation in sorted_rejects:
+        if deficit <= 0:
+            break
+        meal = violation.get('meal')
+        if not isinstance(meal, dict):
+            continue
+        name_key = (meal.get('name') or '').strip().lower()
+        if name_key and name_key in taken:
+            continue
+        taken.add(name_key)
+        meal_note = (
+            f"{violation.get('calories')} kcal (goal {violation['rule']['operator_text']} "
+            f"{violation['rule']['value']})"
+        )
+        meal['_calorie_warning'] = meal_note
+        meals.append(meal)
+        deficit -= 1
+    return meals
+
+
+def _assign_meal_ids(meals: list[dict], uid) -> None:
+    try:
+        ids = generatemealIDs(uid, len(meals)) if isinstance(meals, list) else []
+    except Exception:
+        logging.exception('generatemealIDs failed')
+        ids = [f"{uid or 0}_{i+1}" for i in range(len(meals))]
+
+    for i in range(len(meals)):
+        if i < len(ids):
+            meals[i]['id'] = ids[i]
+        else:
+            meals[i]['id'] = meals[i].get('id') or f"{uid or 0}_{i+1}"
+
+
+def _missing_counts(accepted: list[dict], ctx: _GenerationContext) -> dict[str, int]:
+    """Per-daypart counts still needed once `accepted` meals are kept."""
+    have = {k: 0 for k in ctx.desired_counts}
+    for meal in accepted:
+        mtype = _normalize_meal_type(meal.get('mealType'))
+        if mtype:
+            have[mtype] += 1
+    missing = {k: max(0, ctx.desired_counts[k] - have[k]) for k in ctx.desired_counts}
+
+    # untyped meals still fill a slot, so never ask for more than the overall gap
+    overflow = sum(missing.values()) - max(0, ctx.total_needed - len(accepted))
+    for k in ('dinner', 'lunch', 'breakfast'):
+        if overflow <= 0:
+            break
+        cut = min(missing[k], overflow)
+        missing[k] -= cut
+        overflow -= cut
+    return missing
+
+
+def _generate_meals(ctx: _GenerationContext) -> list[dict]:
+    """Run the model (with retries) and return validated meals with USDA macros.
+
+    Retries keep the meals that already passed validation and only ask the model
+    for the breakfast/lunch/dinner slots that are still empty.
+    """
+    steps = _generate_meals_steps(ctx)
+    wanted, meals = _advance_generation(steps)
+    while wanted is not None:
+        counts, avoid_names = wanted
+        wanted, meals = _advance_generation(steps, _request_meals(ctx, counts, avoid_names=avoid_names))
+    return meals
+
+
+async def _generate_meals_async(ctx: _GenerationContext) -> list[dict]:
+    """_generate_meals for the event loop: model calls are awaited, the rest runs in threads."""
+    steps = _generate_meals_steps(ctx)
+    wanted, meals = await asyncio.to_thread(_advance_generation, steps)
+    while wanted is not None:
+        counts, avoid_names = wanted
+        response = await _request_meals_async(ctx, counts, avoid_names=avoid_names)
+        wanted, meals = await asyncio.to_thread(_advance_generation, steps, response)
+    return meals
+
+
+def _advance_generation(steps, response=None):
+    """Feed one model response to _generate_meals_steps: ((counts, avoid_names), None) or (None, meals)."""
+    try:
+        return steps.send(response), None
+    except StopIteration as done:
+        return None, done.value
+
+
+def _generate_meals_steps(ctx: _GenerationContext):
+    """Validation and retry logic of _generate_meals, without the model call.
+
+    Yields (counts, avoid_names) for each model request and expects
+    (raw meals, partial_response) sent back; returns the final meals.
+    """
+    MAX_MODEL_ATTEMPTS = 2
+    attempt = 0
+    accepted: list[dict] = []
+    request_counts = dict(ctx.desired_counts)
+
+    calorie_rule_violations_seen: list[dict] = []
+
+    while True:
+        avoid_names = [m['name'] for m in accepted]
+        meals, partial_response = yield request_counts, avoid_names
+
+        try:
+            normalize_meals(meals)
+        except Exception:
+            logging.exception('normalize_meals failed')
+
+        dropped_for_weight = 0
+        dropped_for_calorie = 0
+        taken = {name.strip().lower() for name in avoid_names}
+        meals = [m for m in (_clean_generated_meal(m, ctx) for m in meals) if m is not None]
+        meals = [m for m in meals if m['name'].strip().lower() not in taken]
+        meals = _limit_to_counts(meals, request_counts)
 
                 # --- overwrite macros from USDA facts (single, authoritative pass) ---
         try:
-            apply_usda_macros(meals, fact_cache=tool_fact_cache)
+            apply_usda_macros(meals, fact_cache=ctx.tool_fact_cache)
             for m in meals:
                 m['_macro_source'] = m.get('_usda_macro_source', 'usda')
         except Exception:
             logging.exception("Failed to overwrite macros with USDA data")
 
         calorie_rule_violations: list[dict] = []
-        if calorie_rules:
-            meals, calorie_rule_violations = _enforce_calorie_rules(meals, calorie_rules)
+        if ctx.calorie_rules:
+            meals, calorie_rule_violations = _enforce_calorie_rules(meals, ctx.calorie_rules)
             if calorie_rule_violations:
                 dropped_for_calorie += len(calorie_rule_violations)
                 details = ", ".join(
@@ -1309,11 +1776,12 @@ def startMealPlan():
                     for v in calorie_rule_violations
                 )
                 logging.warning('Dropped %d meals for calorie rules: %s', len(calorie_rule_violations), details)
-            last_calorie_rule_violations = calorie_rule_violations or []
+            calorie_rule_violations_seen.extend(calorie_rule_violations)
 
+        accepted.extend(meals)
 
         need_retry = False
-        if not meals and (dropped_for_weight or dropped_for_calorie) and attempt < (MAX_MODEL_ATTEMPTS - 1):
+        if not accepted and (dropped_for_weight or dropped_for_calorie) and attempt < (MAX_MODEL_ATTEMPTS - 1):
             reasons = []
             if dropped_for_weight:
                 reasons.append('missing weights')
@@ -1325,12 +1793,13 @@ def startMealPlan():
                 attempt + 1, MAX_MODEL_ATTEMPTS
             )
             need_retry = True
-        elif total_needed and len(meals) < total_needed and attempt < (MAX_MODEL_ATTEMPTS - 1):
+        elif ctx.total_needed and len(accepted) < ctx.total_needed and attempt < (MAX_MODEL_ATTEMPTS - 1):
+            request_counts = _missing_counts(accepted, ctx)
             logging.warning(
-                'Generated %d/%d meals (partial=%s); retrying attempt %d/%d',
-                len(meals), total_needed, partial_response, attempt + 1, MAX_MODEL_ATTEMPTS
+                'Generated %d/%d meals (partial=%s); retrying attempt %d/%d for %s',
+                len(accepted), ctx.total_needed, partial_response, attempt + 1, MAX_MODEL_ATTEMPTS, request_counts
             )
-            need_retry = True
+            need_retry = sum(request_counts.values()) > 0
 
         if need_retry:
             attempt += 1
@@ -1338,69 +1807,25 @@ def startMealPlan():
 
         break
 
-    # generate ids and attach
-    uid = session.get('user_id')
-    try:
-        ids = generatemealIDs(uid, len(meals)) if isinstance(meals, list) else []
-    except Exception:
-        logging.exception('generatemealIDs failed')
-        ids = [f"{uid or 0}_{i+1}" for i in range(len(meals))]
+    meals = accepted
+    last_calorie_rule_violations = calorie_rule_violations_seen
 
-    for i in range(len(meals)):
-        if i < len(ids):
-            meals[i]['id'] = ids[i]
-        else:
-            meals[i]['id'] = meals[i].get('id') or f"{uid or 0}_{i+1}"
+    # generate ids and attach
+    _assign_meal_ids(meals, ctx.user_id)
 
-    # keep what the model said (for transparency if you want to display it)
-    for m in meals:
-        m['_model_calories'] = m.get('calories', 0)
-        m['_model_protein']  = m.get('protein', 0)
-        m['_model_carbs']    = m.get('carbs', 0)
-        m['_model_fats']     = m.get('fats', 0)
-
-    # overwrite macros with verified USDA totals
-    try:
-        apply_usda_macros(meals, fact_cache=tool_fact_cache)
-    except Exception:
-        logging.exception('Failed to overwrite macros with USDA data')
-
-    if total_needed and len(meals) < total_needed and last_calorie_rule_violations:
-        deficit = total_needed - len(meals)
-        logging.warning('Filling %d slots with closest calorie matches despite rule violations', deficit)
-        sorted_rejects = sorted(
-            last_calorie_rule_violations,
-            key=lambda v: abs((v.get('calories') or 0) - (v.get('rule', {}).get('value') or 0))
-        )
-        for violation in sorted_rejects:
-            if deficit <= 0:
-                break
-            meal = violation.get('meal')
-            if not isinstance(meal, dict):
-                continue
-            meal_note = (
-                f"{violation.get('calories')} kcal (goal {violation['rule']['operator_text']} "
-                f"{violation['rule']['value']})"
-            )
-            meal['_calorie_warning'] = meal_note
-            meals.append(meal)
-            deficit -= 1
-        data['meals'] = meals
+    meals = _fill_from_calorie_violations(meals, last_calorie_rule_violations, ctx.total_needed)
 
     # tag source (e.g., 'live_lookup' or 'cached_lookup')
     for m in meals:
         m['_macro_source'] = m.get('_usda_macro_source', 'unverified')
 
-    # commit the updated meals back into the payload passed to the template
-    data['meals'] = meals
+    return meals
 
 
-    # save if logged in
-    print(meals)
+def _save_generated_meals(uid, meals: list[dict]) -> None:
     try:
 
         # --- generate unique IDs and attach them to meals ---
-        uid = session.get('user_id')
         if uid and meals:
             try:
                 ids = generatemealIDs(uid, len(meals))
@@ -1430,74 +1855,218 @@ def startMealPlan():
     except Exception:
         logging.exception('Failed to save new meals')
 
-    collections = getUserMeals(uid) if uid else []
-    return render_template("results.html", data=data, collections=collections)
 
-@app.route("/build_shopping_list", methods=["POST"])
-def build_shopping_list():
-    selected_ids = {value.strip() for value in request.form.getlist("selected_meals") if value.strip()}
-    uid = session.get('user_id')
-    allowed_ids = {str(mid) for mid in (session.get('shopping_meal_ids') or [])}
+def _sse(event: str, payload) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
 
-    def _coerce_float(value):
-        try:
-            if value in (None, ""):
-                return None
-            return float(value)
-        except (TypeError, ValueError):
-            return None
 
-    aggregated: dict[tuple[str, str], dict[str, float | str]] = {}
-    uncounted: dict[str, int] = {}
+def _stream_meal_events(ctx: _GenerationContext):
+    """Yield SSE frames, one per meal as soon as it clears validation and macros."""
+    yield ": generation started\n\n"
 
-    if uid:
-        saved_meals = getAllMeals(uid) or []
-        for record in saved_meals:
-            meal_id = str(record.meal_id)
-            if not meal_id:
+    uid = ctx.user_id
+    # reserve ids up front so every streamed card can be selected for saving right away
+    slots = ctx.total_needed or 3
+    try:
+        ids = generatemealIDs(uid, slots)
+    except Exception:
+        logging.exception('generatemealIDs failed')
+        ids = [f"{uid or 0}_{i+1}" for i in range(slots)]
+
+    meals: list[dict] = []
+    violations: list[dict] = []
+    counts = {k: 0 for k in ctx.desired_counts}
+
+    def _emit(meal: dict) -> str:
+        idx = len(meals)
+        meal['id'] = ids[idx] if idx < len(ids) else f"{uid or 0}_{idx+1}"
+        meal['_macro_source'] = meal.get('_usda_macro_source', 'unverified')
+        meals.append(meal)
+        html = render_template('_meal_card.html', r=meal, idx=idx)
+        return _sse('meal', {"index": idx, "meal": meal, "html": html})
+
+    try:
+        for raw_meal in stream_model(ctx.prompt, tool_executor=ctx.lookup_tool):
+            if ctx.total_needed and len(meals) >= ctx.total_needed:
+                break
+            try:
+                normalize_meals([raw_meal])
+            except Exception:
+                logging.exception('normalize_meals failed')
+            meal = _clean_generated_meal(raw_meal, ctx)
+            if meal is None:
                 continue
-            if selected_ids:
-                if meal_id not in selected_ids and record.recipe_name not in selected_ids:
-                    continue
-            elif allowed_ids and meal_id not in allowed_ids:
+            mtype = _normalize_meal_type(meal.get('mealType'))
+            if mtype and ctx.total_needed and counts[mtype] >= ctx.desired_counts[mtype]:
                 continue
 
-            for entry in _deserialize_list(record.ingredients):
-                if isinstance(entry, dict):
-                    name = (
-                        entry.get('name')
-                        or entry.get('ingredient')
-                        or entry.get('item')
-                        or entry.get('raw')
-                    )
-                    qty = _coerce_float(entry.get('quantity') or entry.get('qty') or entry.get('amount'))
-                    unit = (entry.get('unit') or entry.get('units') or '').strip()
-                else:
-                    name = str(entry).strip()
-                    qty = None
-                    unit = ''
-
-                if not name:
-                    continue
+            try:
+                apply_usda_macros([meal], fact_cache=ctx.tool_fact_cache)
+            except Exception:
+                logging.exception('Failed to overwrite macros with USDA data')
 
-                if qty is None:
-                    uncounted[name] = uncounted.get(name, 0) + 1
+            if ctx.calorie_rules:
+                kept, rejected = _enforce_calorie_rules([meal], ctx.calorie_rules)
+                if rejected:
+                    logging.warning('Dropped %s for calorie rules (%s kcal)', meal['name'], meal.get('calories'))
+                    violations.extend(rejected)
                     continue
 
-                key = (name.strip().lower(), unit.lower())
-                bucket = aggregated.setdefault(key, {
-                    'name': name.strip(),
-                    'unit': unit,
-                    'quantity': 0.0,
-                })
-                bucket['quantity'] = float(bucket['quantity']) + qty
+            if mtype:
+                counts[mtype] += 1
+            yield _emit(meal)
+    except Exception:
+        logging.exception('Streaming generation failed')
+        yield _sse('error', {"message": "Meal generation failed"})
+
+    before = len(meals)
+    filled = _fill_from_calorie_violations(list(meals), violations, ctx.total_needed)
+    for meal in filled[before:]:
+        yield _emit(meal)
+
+    _save_generated_meals(uid, meals)
+    yield _sse('done', {"count": len(meals), "requested": ctx.total_needed})
+
+
+async def _run_generation_job(job_id: str, payload: dict, report) -> dict:
+    """Worker side of a queued meal plan: same pipeline as the POST, minus the request.
+
+    Runs on the job queue's event loop, so a job waiting on the model holds no
+    thread; database and USDA work goes to worker threads.
+    """
+    uid = payload.get('user_id')
+    form = MultiDict([tuple(item) for item in payload.get('form') or []])
+    with app.app_context():
+        await asyncio.to_thread(report, stage='building prompt')
+        ctx = await asyncio.to_thread(_build_generation_context, form, uid)
+        await asyncio.to_thread(report, stage='generating', requested=ctx.total_needed)
+        meals = await _generate_meals_async(ctx)
+        await asyncio.to_thread(report, stage='saving', completed=len(meals))
+        await asyncio.to_thread(_save_generated_meals, uid, meals)
+    return {"meals": meals}
+
+
+def _init_job_queue() -> GenerationJobQueue:
+    return GenerationJobQueue(
+        _run_generation_job,
+        path=(os.getenv("MEAL_PLAN_JOBS_PATH") or DEFAULT_JOBS_PATH).strip(),
+        workers=int(os.getenv("MEAL_PLAN_JOB_WORKERS", "2") or 2),
+        stale_seconds=float(os.getenv("MEAL_PLAN_JOB_STALE_SECONDS", "600") or 600),
+    )
+
+
+JOB_QUEUE = _init_job_queue()
+# the streaming page's form, held server-side between the POST and the one GET that streams it
+FORM_STASH = FormStash(path=(os.getenv("MEAL_PLAN_JOBS_PATH") or DEFAULT_JOBS_PATH).strip())
+
+
+def _session_token() -> str:
+    """Random per-browser token; ties background work to the session that started it (logged in or not)."""
+    token = session.get('generation_token')
+    if not token:
+        token = secrets.token_urlsafe(24)
+        session['generation_token'] = token
+    return token
+
+
+# main function 
+# use for testing
+# adjust user prefrences here
+# if you add new preferences in the above classes
+# be sure to add them here too
+@app.route("/startMealPlan", methods = ['GET', 'POST'])
+def startMealPlan():
+    # Tess TO DO:
+    # modify to be able to read global user preferences
+    # merge final constraints
+    # pass merged constraints into promptGen.generate_prompt(final_constraints)
+    if request.method == 'GET':
+        return render_template("mealGen.html")
+
+    uid = session.get('user_id')
+    collections = getUserMeals(uid) if uid else []
+
+    if _STREAMING_ENABLED:
+        # render the shell now; the page pulls meals from /startMealPlan/stream as they finish.
+        # Only a one-time token goes in the URL so the form stays out of logs and history.
+        token = FORM_STASH.put(_session_token(), list(request.form.items(multi=True)))
+        stream_url = url_for('startMealPlanStream', token=token)
+        return render_template("results.html", data={"meals": []}, collections=collections, stream_url=stream_url)
+
+    if _JOBS_ENABLED:
+        # hand the form to a worker and return right away; the page polls for progress
+        form_items = list(request.form.items(multi=True))
+        job_id = JOB_QUEUE.submit(uid, {"form": form_items, "user_id": uid}, owner=_session_token())
+        job_url = url_for('jobStatus', job_id=job_id)
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({"job_id": job_id, "status_url": job_url}), 202
+        return render_template("results.html", data={"meals": []}, collections=collections, job_url=job_url)
+
+    ctx = _build_generation_context(request.form, uid)
+    meals = _generate_meals(ctx)
+
+    # commit the updated meals back into the payload passed to the template
+    data = {"meals": meals}
+
+    # save if logged in
+    print(meals)
+    _save_generated_meals(uid, meals)
+
+    return render_template("results.html", data=data, collections=collections)
+
+
+@app.route("/startMealPlan/stream", methods=['GET'])
+def startMealPlanStream():
+    # consumed here, so a reload or an EventSource reconnect cannot start (and save) a second plan
+    form_items = FORM_STASH.take(request.args.get('token'), session.get('generation_token'))
+    if form_items is None:
+        return Response(status=404)
+    form = MultiDict([tuple(item) for item in form_items])
+    ctx = _build_generation_context(form, session.get('user_id'))
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(_stream_meal_events(ctx)), mimetype='text/event-stream', headers=headers)
+
+@app.route("/jobs/<job_id>", methods=['GET'], endpoint="jobStatus")
+def job_status(job_id):
+    job = JOB_QUEUE.get(job_id)
+    token = session.get('generation_token')
+    if (
+        job is None
+        or job['user_id'] != session.get('user_id')
+        or not token
+        or not secrets.compare_digest(job['owner'] or '', token)
+    ):
+        return jsonify({"error": "job not found"}), 404
+
+    meals = (job['result'] or {}).get('meals') or []
+    body = {
+        "job_id": job['id'],
+        "status": job['status'],
+        "stage": job['stage'],
+        "requested": job['requested'],
+        "completed": job['completed'] or len(meals),
+        "error": job['error'],
+        "meals": meals,
+    }
+    if job['status'] == DONE:
+        body["html"] = [render_template('_meal_card.html', r=meal, idx=idx) for idx, meal in enumerate(meals)]
+    return jsonify(body)
+
+
+@app.route("/build_shopping_list", methods=["POST"])
+def build_shopping_list():
+    selected_ids = {value.strip() for value in request.form.getlist("selected_meals") if value.strip()}
+    uid = session.get('user_id')
+    allowed_ids = {str(mid) for mid in (session.get('shopping_meal_ids') or [])}
+
+    # only the chosen meals are read; with nothing ticked, fall back to the ones the page showed
+    meal_ids = selected_ids or allowed_ids or None
+    aggregated, uncounted = getShoppingListTotals(uid, meal_ids) if uid else ([], {})
 
     items: list[tuple[str, str]] = []
-    for entry in aggregated.values():
-        qty = entry['quantity']
-        unit = entry['unit']
+    for name, unit, qty in aggregated:
         display = f"{qty:g} {unit}".strip()
-        items.append((entry['name'], display or f"{qty:g}"))
+        items.append((name, display or f"{qty:g}"))
 
     for name, count in uncounted.items():
         label = f"x{count}" if count > 1 else "as needed"